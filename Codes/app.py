@@ -4,6 +4,7 @@
 from flask import Flask, redirect, session, url_for
 from config import Config
 from routes import auth_bp, staff_bp, patient_bp, medication_bp
+from medication_index import medication_index
 
 app = Flask(__name__)
 app.secret_key = 'your_secret_key'  # Do NOT touch this, this is the key that was set up with DB
@@ -13,6 +14,12 @@ app.register_blueprint(staff_bp)
 app.register_blueprint(patient_bp)
 app.register_blueprint(medication_bp)
 
+# Warm the medication autocomplete index in the background
+# Not in the password hashing workers (see password_hashing.py): they are spawned processes that
+# import this file again as their main module, named __mp_main__, and need no index or DB connection
+if __name__ != '__mp_main__':
+    medication_index.start()
+
 # Default landing page when starting the app
 @app.route('/')
 def index():
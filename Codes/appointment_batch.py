@@ -0,0 +1,122 @@
+# This file applies staff actions to many appointments at once (complete, delete, reschedule).
+# Each batch costs a fixed number of DB round trips however many appointments it covers,
+# and every function returns one result per requested appointment, in the order they were given:
+#   {"appt_id": "...", "ok": True} or {"appt_id": "...", "ok": False, "error": "..."}
+
+from datetime import datetime
+from bson.objectid import ObjectId, InvalidId
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+from slot_availability import SLOT_TIMES
+
+DUPLICATE_KEY = 11000
+SLOT_TAKEN = "This appointment slot is already taken."
+
+def _result(appt_id, error=None):
+    if error:
+        return {"appt_id": appt_id, "ok": False, "error": error}
+    return {"appt_id": appt_id, "ok": True}
+
+# Parse the requested ids, returning {position: ObjectId} of the valid ones and the results list to fill in
+def _parse_ids(appt_ids):
+    results = [None] * len(appt_ids)
+    parsed = {}
+    for i, appt_id in enumerate(appt_ids):
+        try:
+            parsed[i] = ObjectId(appt_id)
+        except (InvalidId, TypeError):
+            results[i] = _result(str(appt_id), "Invalid appointment ID.")
+    return parsed, results
+
+# Mark the given pending appointments as completed with one update_many
+def complete_appointments(db, appt_ids):
+    parsed, results = _parse_ids(appt_ids)
+    found = {
+        appointment["_id"]: appointment.get("appt_status")
+        for appointment in db.Appointments.find({"_id": {"$in": list(parsed.values())}}, {"appt_status": 1})
+    }
+
+    to_complete = []
+    for i, oid in parsed.items():
+        if oid not in found:
+            results[i] = _result(appt_ids[i], "Appointment not found.")
+        elif found[oid] == "Completed":
+            results[i] = _result(appt_ids[i], "Appointment is already completed.")
+        else:
+            to_complete.append(oid)
+            results[i] = _result(appt_ids[i])
+
+    if to_complete:
+        db.Appointments.update_many({"_id": {"$in": to_complete}}, {"$set": {"appt_status": "Completed"}})
+    return results
+
+# Delete the given appointments with one delete_many
+def delete_appointments(db, appt_ids):
+    parsed, results = _parse_ids(appt_ids)
+    found = {appointment["_id"] for appointment in db.Appointments.find({"_id": {"$in": list(parsed.values())}}, {"_id": 1})}
+
+    for i, oid in parsed.items():
+        results[i] = _result(appt_ids[i]) if oid in found else _result(appt_ids[i], "Appointment not found.")
+
+    if found:
+        db.Appointments.delete_many({"_id": {"$in": list(found)}})
+    return results
+
+# Move appointments to new slots. moves is a list of {"appt_id", "date" (YYYY-MM-DD), "time" (HH:MM)}
+# Slot conflicts, with existing appointments or with another move in the batch, are checked with one query
+# before writing; the unique slot index still catches any booking made in the meantime
+def reschedule_appointments(db, moves):
+    parsed, results = _parse_ids([move.get("appt_id") for move in moves])
+
+    slots = {}
+    for i in list(parsed):
+        try:
+            date = datetime.strptime(moves[i].get("date") or "", '%Y-%m-%d')
+        except ValueError:
+            results[i] = _result(moves[i].get("appt_id"), "Invalid date format.")
+            del parsed[i]
+            continue
+        time = moves[i].get("time")
+        if time not in SLOT_TIMES:
+            results[i] = _result(moves[i].get("appt_id"), "Appointments must be booked at 30-minute intervals.")
+            del parsed[i]
+            continue
+        slots[i] = (date, time)
+
+    # Which appointments exist and who currently holds each target slot, in two queries
+    found = {appointment["_id"] for appointment in db.Appointments.find({"_id": {"$in": list(parsed.values())}}, {"_id": 1})}
+    holders = {}
+    if slots:
+        taken = db.Appointments.find(
+            {"$or": [{"appt_date": date, "appt_time": time} for date, time in set(slots.values())]},
+            {"appt_date": 1, "appt_time": 1}
+        )
+        holders = {(appointment["appt_date"], appointment["appt_time"]): appointment["_id"] for appointment in taken}
+
+    updates = []
+    positions = []
+    claimed = set()
+    for i, oid in parsed.items():
+        appt_id = moves[i].get("appt_id")
+        slot = slots[i]
+        holder = holders.get(slot)
+        if oid not in found:
+            results[i] = _result(appt_id, "Appointment not found.")
+        elif (holder is not None and holder != oid) or slot in claimed:
+            results[i] = _result(appt_id, SLOT_TAKEN)
+        else:
+            claimed.add(slot)
+            updates.append(UpdateOne({"_id": oid}, {"$set": {"appt_date": slot[0], "appt_time": slot[1]}}))
+            positions.append(i)
+            results[i] = _result(appt_id)
+
+    if updates:
+        try:
+            db.Appointments.bulk_write(updates, ordered=False)
+        except BulkWriteError as e:
+            # Report the moves rejected by the DB against their own appointment, the rest were applied
+            for error in e.details.get("writeErrors", []):
+                i = positions[error["index"]]
+                message = SLOT_TAKEN if error.get("code") == DUPLICATE_KEY else error.get("errmsg", "Update failed.")
+                results[i] = _result(moves[i].get("appt_id"), message)
+    return results
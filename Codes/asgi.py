@@ -0,0 +1,57 @@
+# asgi.py (async entry point)
+# Alternative to app.py for serving many concurrent requests from one process:
+#     pip install quart hypercorn "pymongo>=4.13"
+#     hypercorn asgi:application --bind 0.0.0.0:5000
+# Extra dependencies, only needed for this entry point: quart, hypercorn, and a pymongo that ships
+# AsyncMongoClient (4.13 or later, see async_db.py). app.py runs without them.
+# The busiest staff routes (see async_routes.py) are served by a Quart app on the async DB driver.
+# Every other request is passed to the Flask app from app.py, which runs in a thread pool as before.
+# Both apps use the same secret key, so a session started on one is valid on the other.
+
+from quart import Quart
+from hypercorn.middleware import AsyncioWSGIMiddleware
+from werkzeug.exceptions import HTTPException
+from app import app as flask_app
+from async_db import AsyncDatabaseManager
+from async_routes import async_staff_bp
+
+async_app = Quart(__name__)
+async_app.secret_key = flask_app.secret_key
+async_app.config.from_mapping(flask_app.config)
+async_app.register_blueprint(async_staff_bp)
+
+# Endpoints whose requests are answered by async_app
+ASYNC_ENDPOINTS = set(async_app.view_functions) - {'static'}
+
+# Register the URLs of every other Flask route too, so url_for in templates can still build them.
+# Requests for them never reach these views, they are dispatched to the Flask app.
+async def served_by_flask(**kwargs):
+    return "Not Found", 404
+
+for rule in flask_app.url_map.iter_rules():
+    if rule.endpoint not in async_app.view_functions:
+        async_app.add_url_rule(rule.rule, endpoint=rule.endpoint, view_func=served_by_flask,
+                               methods=rule.methods - {'HEAD', 'OPTIONS'})
+
+wsgi_app = AsyncioWSGIMiddleware(flask_app)
+url_adapter = async_app.url_map.bind('')
+
+@async_app.after_serving
+async def close_db():
+    if AsyncDatabaseManager._instance is not None:
+        await AsyncDatabaseManager().close()
+
+# Send a request to async_app if it is for one of the async endpoints, otherwise to the Flask app
+def is_async_request(scope):
+    try:
+        endpoint, _ = url_adapter.match(scope['path'], method=scope['method'])
+    except HTTPException:  # Not found, wrong method or a redirect, all left to the Flask app
+        return False
+    return endpoint in ASYNC_ENDPOINTS
+
+async def application(scope, receive, send):
+    if scope['type'] == 'http' and not is_async_request(scope):
+        await wsgi_app(scope, receive, send)
+    else:
+        # Lifespan and websocket events are handled by async_app
+        await async_app(scope, receive, send)
@@ -0,0 +1,38 @@
+# This file manages the shared async connection to our DB, used by the ASGI entry point (asgi.py).
+# It is the async counterpart of DatabaseManager in db_config.py, with the same pool settings.
+
+from pymongo import AsyncMongoClient
+import certifi
+from config import Config
+
+class AsyncDatabaseManager:
+    _instance = None
+
+    # Only created from the event loop thread, so no lock is needed
+    def __new__(cls):
+        if cls._instance is None:
+            instance = super(AsyncDatabaseManager, cls).__new__(cls)
+            instance._connect()
+            cls._instance = instance
+        return cls._instance
+
+    # The client binds to the running event loop on first use, and many requests share its connection pool
+    def _connect(self):
+        self.client = AsyncMongoClient(
+            Config.MONGO_URI,
+            tlsCAFile=certifi.where(),
+            maxPoolSize=Config.MONGO_MAX_POOL_SIZE,
+            minPoolSize=Config.MONGO_MIN_POOL_SIZE,
+            waitQueueTimeoutMS=Config.MONGO_WAIT_QUEUE_TIMEOUT_MS
+        )
+        self.db = self.client[Config.DATABASE_NAME]
+
+    def get_db(self):
+        return self.db
+
+    async def close(self):
+        await self.client.close()
+        AsyncDatabaseManager._instance = None
+
+def get_async_db():
+    return AsyncDatabaseManager().get_db()
@@ -0,0 +1,136 @@
+# This file contains the async versions of the busiest staff routes, served by the ASGI entry point (asgi.py).
+# They behave the same as their counterparts in routes/staff.py, but await the DB instead of blocking a thread on it,
+# so one process can keep many of these requests in flight. Endpoint names match the Flask ones, so templates
+# and url_for work unchanged; every other route is still served by the Flask app.
+
+import asyncio
+import logging
+from quart import Blueprint, render_template, request, redirect, session, url_for, flash, jsonify, current_app
+from bson.objectid import ObjectId, InvalidId
+from async_db import get_async_db
+from medication_index import search_medications as lookup_medications
+from patient_search import build_search_pipeline, format_dashboard_patient, dashboard_filters
+from patient_search import advanced_search_filters, format_search_patient, ADVANCED_SEARCH_PROJECTION
+from patient_search import explain_command, summarise_explain
+from patient_history import past_prescriptions_pipeline, format_record_dates
+from pagination import decode_cursor, build_page
+
+async_staff_bp = Blueprint('staff', __name__)
+
+async def aggregate(collection, pipeline):
+    cursor = await collection.aggregate(pipeline)
+    return await cursor.to_list()
+
+# Staff Dashboard route
+@async_staff_bp.route('/staff_dashboard', methods=['GET'])
+async def staff_dashboard():
+    if 'is_staff' in session and session['is_staff'] == 1:
+        db = get_async_db()
+
+        try:
+            query, patient_query = dashboard_filters(request.args)
+        except InvalidId:
+            await flash("Invalid User ID format.")
+            return redirect(url_for('staff.staff_dashboard'))
+        except ValueError:
+            # An unparseable filter value cannot match any patient
+            return await render_template('staff_dashboard.html', patients=[])
+
+        try:
+            cursor = decode_cursor(request.args.get('cursor'))
+        except ValueError as e:
+            await flash(str(e))
+            return redirect(url_for('staff.staff_dashboard'))
+
+        # Fetch one page of users and their patient records in a single aggregation
+        page_size = current_app.config['PAGE_SIZE']
+        collection, pipeline, key = build_search_pipeline(query, patient_query, cursor, page_size)
+        patients, next_cursor, prev_cursor = build_page(await aggregate(db[collection], pipeline), cursor, page_size, key)
+        patients = [format_dashboard_patient(patient) for patient in patients]
+
+        # Keep the current filters on the next/prev links
+        filters = request.args.to_dict()
+        filters.pop('cursor', None)
+        next_url = url_for('staff.staff_dashboard', **filters, cursor=next_cursor) if next_cursor else None
+        prev_url = url_for('staff.staff_dashboard', **filters, cursor=prev_cursor) if prev_cursor else None
+
+        return await render_template('staff_dashboard.html', patients=patients, next_url=next_url, prev_url=prev_url)
+    else:
+        await flash('Please login or create a new account to access our services.')
+        return redirect(url_for('auth.login'))
+
+# View patient details. Only GET is served here, prescriptions and diagnoses are posted to the Flask route.
+@async_staff_bp.route('/view_patient/<string:patient_id>/<string:appt_id>', methods=['GET'])
+async def view_patient(patient_id, appt_id):
+    db = get_async_db()
+
+    # Convert patient_id to ObjectId
+    try:
+        patient_object_id = ObjectId(patient_id)
+    except Exception as e:
+        await flash(f"Error converting patient_id to ObjectId: {e}", "danger")
+        return redirect(url_for('staff.staff_dashboard'))
+
+    # The patient, their history and their past prescriptions are independent, so fetch them at the same time
+    patient_info, patient_history, past_prescriptions = await asyncio.gather(
+        db.Patients.find_one({"_id": patient_object_id}),
+        db.PatientHistory.find({"patient_id": patient_object_id}).to_list(),
+        aggregate(db.Prescriptions, past_prescriptions_pipeline(patient_object_id))
+    )
+    if not patient_info:
+        await flash(f"Patient not found for patient_id: {patient_id}", "danger")
+        return redirect(url_for('staff.staff_dashboard'))
+
+    return await render_template('view_patient.html',
+                                 patient=patient_info,
+                                 history=format_record_dates(patient_history),
+                                 prescriptions=format_record_dates(past_prescriptions),
+                                 appt_id=appt_id)
+
+# Advanced search routes
+# Search feature for staff only using different parameters to find patients
+@async_staff_bp.route('/advanced_search', methods=['POST'])
+async def advanced_search():
+    if 'is_staff' not in session or session['is_staff'] != 1:
+        return jsonify({'error': 'Unauthorized'}), 403
+
+    db = get_async_db()
+    form = await request.form
+
+    try:
+        cursor = decode_cursor(form.get('cursor'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    page_size = current_app.config['PAGE_SIZE']
+
+    user_conditions, patient_conditions = advanced_search_filters(form)
+    collection, pipeline, key = build_search_pipeline(user_conditions, patient_conditions, cursor, page_size, ADVANCED_SEARCH_PROJECTION)
+
+    try:
+        patients, next_cursor, prev_cursor = build_page(await aggregate(db[collection], pipeline), cursor, page_size, key)
+        patients = [format_search_patient(patient) for patient in patients]
+
+        response = {'patients': patients, 'next': next_cursor, 'prev': prev_cursor}
+
+        # In debug mode, report how the search was executed
+        if current_app.debug:
+            explain = await db.command("explain", explain_command(collection, pipeline), verbosity="executionStats")
+            response['explain'] = summarise_explain(explain, collection, pipeline)
+
+        return jsonify(response)
+    except Exception as e:
+        logging.error(f"Advanced search failed: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+# Search medications route. Same feature as medications.
+@async_staff_bp.route('/search_medications')
+async def search_medications():
+    query = request.args.get('query', '').strip()
+
+    if not query:
+        return jsonify([])  # Return empty if no query is provided
+
+    # Answered from the in-memory autocomplete index, which never waits for the DB
+    results = lookup_medications(query, limit=20)
+
+    return jsonify(results)
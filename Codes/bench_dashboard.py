@@ -0,0 +1,80 @@
+# This file checks that a staff dashboard page costs the same number of DB round trips however many patients there are.
+# Run it against a local mongod (MONGO_URI=mongodb://localhost:27017): python bench_dashboard.py
+# It fills a scratch database (<DATABASE_NAME>_bench, dropped at the end) with 10 and then 1000 patients.
+# For each size it loads a dashboard page with no filter, a user filter and a patient filter. A pymongo
+# CommandListener counts the commands sent. The counts must not change with the number of patients.
+
+import sys
+import time
+from pymongo import MongoClient, monitoring
+from config import Config
+from pagination import build_page
+from patient_search import build_search_pipeline, add_search_fields, identifier_filter
+
+SIZES = (10, 1000)
+
+class CommandCounter(monitoring.CommandListener):
+    def __init__(self):
+        self.commands = []
+
+    def started(self, event):
+        self.commands.append(event.command_name)
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+# Dashboard filters to time: (name, user query, patient query)
+def dashboard_queries():
+    field, condition = identifier_filter("Username", "bench", "prefix")
+    return [
+        ("no filter", {"IsStaff": 0}, {}),
+        ("username prefix", {"IsStaff": 0, field: condition}, {}),
+        ("gender", {"IsStaff": 0}, {"PatientGender": "F"}),
+    ]
+
+def seed(db, count):
+    db.Users.delete_many({})
+    db.Patients.delete_many({})
+    users = [add_search_fields({"Username": f"bench{i}", "Email": f"bench{i}@example.com", "IsStaff": 0})
+             for i in range(count)]
+    user_ids = db.Users.insert_many(users).inserted_ids
+    db.Patients.insert_many([
+        add_search_fields({"PatientName": f"Patient {i}", "NRIC": f"S{i:07d}A", "PatientGender": "FM"[i % 2],
+                           "UserID": user_id})
+        for i, user_id in enumerate(user_ids)
+    ])
+    db.Patients.create_index("UserID")
+
+def main():
+    counter = CommandCounter()
+    client = MongoClient(Config.MONGO_URI, event_listeners=[counter])
+    db = client[Config.DATABASE_NAME + "_bench"]
+
+    counts = {}
+    try:
+        for size in SIZES:
+            seed(db, size)
+            for name, user_query, patient_query in dashboard_queries():
+                collection, pipeline, key = build_search_pipeline(user_query, patient_query, None, Config.PAGE_SIZE)
+                counter.commands.clear()
+                started = time.perf_counter()
+                patients, _, _ = build_page(list(db[collection].aggregate(pipeline)), None, Config.PAGE_SIZE, key)
+                elapsed = (time.perf_counter() - started) * 1000
+                counts[size, name] = len(counter.commands)
+                print(f"{size:>5} patients, {name:<16} {len(patients):>3} rows, "
+                      f"{len(counter.commands)} round trips ({', '.join(counter.commands)}), {elapsed:.1f} ms")
+    finally:
+        client.drop_database(db.name)
+        client.close()
+
+    changed = [name for name, _, _ in dashboard_queries() if len({counts[size, name] for size in SIZES}) != 1]
+    if changed:
+        print(f"FAIL: the number of round trips grows with the number of patients for: {', '.join(changed)}")
+        sys.exit(1)
+    print("OK: the number of round trips does not depend on the number of patients")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+# This file contains a small in-process cache shared by the routes.
+# Entries expire after a time-to-live and the least recently used entries are evicted once the cache is full.
+# Bumping the generation invalidates every entry at once without walking the cache.
+
+import time
+from collections import OrderedDict
+from threading import Lock
+
+class TTLCache:
+    def __init__(self, maxsize=256, ttl=60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    # Returns the cached value, or None if it is missing, has expired or is from an older generation
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, expires_at, generation = entry
+                if expires_at >= time.monotonic() and generation == self.generation:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    # Pass the generation read before computing the value, so a value computed across a bump is never served
+    def set(self, key, value, generation=None):
+        with self._lock:
+            if generation is None:
+                generation = self.generation
+            self._entries[key] = (value, time.monotonic() + self.ttl, generation)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    # Invalidate all current entries, they are dropped lazily when next looked up or evicted
+    def bump(self):
+        with self._lock:
+            self.generation += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 3) if total else 0.0,
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "generation": self.generation
+            }
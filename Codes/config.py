@@ -14,3 +14,49 @@ class Config:
     # Database name for MongoDB
     DATABASE_NAME = os.environ.get('DATABASE_NAME', 'clinicDB')
 
+    # Number of patients shown per page on the staff dashboard and advanced search
+    PAGE_SIZE = int(os.environ.get('PAGE_SIZE', 50))
+
+    # Seconds a medication search count is cached for on the Medication List pages
+    MEDICATION_COUNT_TTL = int(os.environ.get('MEDICATION_COUNT_TTL', 60))
+
+    # Seconds before the medication autocomplete index is reloaded to pick up other workers' changes
+    MEDICATION_INDEX_REFRESH = int(os.environ.get('MEDICATION_INDEX_REFRESH', 300))
+
+    # Size and lifetime (seconds) of the cached /search_medications responses
+    TYPEAHEAD_CACHE_SIZE = int(os.environ.get('TYPEAHEAD_CACHE_SIZE', 1024))
+    TYPEAHEAD_CACHE_TTL = int(os.environ.get('TYPEAHEAD_CACHE_TTL', 300))
+
+    # MongoDB connection pool settings, shared by all threads of a worker
+    MONGO_MAX_POOL_SIZE = int(os.environ.get('MONGO_MAX_POOL_SIZE', 100))
+    MONGO_MIN_POOL_SIZE = int(os.environ.get('MONGO_MIN_POOL_SIZE', 0))
+    MONGO_WAIT_QUEUE_TIMEOUT_MS = int(os.environ.get('MONGO_WAIT_QUEUE_TIMEOUT_MS', 10000))
+
+    # Size and lifetime (seconds) of the cached live-filter pages on the staff dashboard
+    DASHBOARD_CACHE_SIZE = int(os.environ.get('DASHBOARD_CACHE_SIZE', 512))
+    DASHBOARD_CACHE_TTL = int(os.environ.get('DASHBOARD_CACHE_TTL', 10))
+
+    # Seconds before the local text index (used when a collection has no TEXT index) is rebuilt
+    TEXT_INDEX_REFRESH = int(os.environ.get('TEXT_INDEX_REFRESH', 300))
+
+    # Seconds the appointment slot availability map is cached for
+    SLOT_CACHE_TTL = int(os.environ.get('SLOT_CACHE_TTL', 30))
+
+    # Threads used to run the independent uniqueness lookups of a form at the same time
+    VALIDATION_THREADS = int(os.environ.get('VALIDATION_THREADS', 8))
+
+    # Password hashing (see password_hashing.py). Stored hashes with a different method or cost are
+    # replaced on the next successful login.
+    PASSWORD_HASH_METHOD = os.environ.get('PASSWORD_HASH_METHOD', 'pbkdf2:sha256:600000')
+    HASH_WORKERS = int(os.environ.get('HASH_WORKERS', 2))  # Worker processes
+    HASH_QUEUE_SIZE = int(os.environ.get('HASH_QUEUE_SIZE', 32))  # Hashes allowed to wait for a worker
+    HASH_TIMEOUT = float(os.environ.get('HASH_TIMEOUT', 5))  # Seconds to wait for a queue slot or a result
+
+    # MedIDs reserved from the counter at a time by each worker, 1 keeps them strictly consecutive
+    MED_ID_BLOCK_SIZE = int(os.environ.get('MED_ID_BLOCK_SIZE', 1))
+
+    # Rows upserted per bulk_write by the medication import (import_medications.py, /import_medications)
+    IMPORT_BATCH_SIZE = int(os.environ.get('IMPORT_BATCH_SIZE', 1000))
+
+    # Patients inserted per transaction by the bulk onboarding (onboard_patients.py), the checkpoint is saved after each
+    ONBOARD_CHUNK_SIZE = int(os.environ.get('ONBOARD_CHUNK_SIZE', 1000))
@@ -1,109 +1,241 @@
-# This file creates the indexes for the collections in our DB.
+# This file manages the shared connection to our DB.
+# Indexes are created by migrate.py, see migrations.py.
 
-from pymongo import MongoClient, ASCENDING, DESCENDING, TEXT
-from pymongo.errors import OperationFailure
+from pymongo import MongoClient, UpdateOne
+from pymongo.errors import DuplicateKeyError, PyMongoError
 from threading import Lock
 import certifi
 from config import Config
+from migrations import check_schema_version, get_schema_version, UNIQUE_APPOINTMENT_SLOT_VERSION
+from datetime import datetime
 import logging
 
+# Raised inside a transaction to abort it, the message is shown to the user
+class PrescriptionError(Exception):
+    pass
+
+# Name of the field whose unique index rejected a write, e.g. "Email", or None if it cannot be told
+def duplicate_key_field(error):
+    details = error.details or {}
+    fields = list(details.get("keyPattern") or details.get("keyValue") or {})
+    if fields:
+        return fields[0]
+    # Older servers only name the index in the message, e.g. "index: Email_1 dup key"
+    message = details.get("errmsg") or str(error)
+    if "index: " in message:
+        return message.split("index: ", 1)[1].split("_", 1)[0]
+    return None
+
 class DatabaseManager:
     _instance = None
     _lock = Lock()  
+    _booking_lock = Lock()  # Only used to book appointments before the unique slot index exists
     
+    # The lock is only taken while the first instance is being created, not on every request
+    # The instance is stored before the schema check, which talks to the DB and runs outside the lock, so a
+    # DB that cannot be reached neither blocks other threads nor makes every request build a new client
     def __new__(cls):
-        with cls._lock:
-            if cls._instance is None:
-                cls._instance = super(DatabaseManager, cls).__new__(cls)
-                cls._instance._initialized = False
-            return cls._instance
-
-    def __init__(self):
-        if self._initialized:
-            return
-            
-        self.client = MongoClient(Config.MONGO_URI, tlsCAFile=certifi.where())
+        if cls._instance is None:
+            created = False
+            with cls._lock:
+                if cls._instance is None:
+                    instance = super(DatabaseManager, cls).__new__(cls)
+                    instance._connect()
+                    cls._instance = instance
+                    created = True
+            if created:
+                cls._instance._check_schema()
+        return cls._instance
+
+    # MongoClient is thread-safe and pools its own connections, so it is shared by all threads without locking
+    # It connects in the background, creating it does not wait for the DB
+    def _connect(self):
+        self.client = MongoClient(
+            Config.MONGO_URI,
+            tlsCAFile=certifi.where(),
+            maxPoolSize=Config.MONGO_MAX_POOL_SIZE,
+            minPoolSize=Config.MONGO_MIN_POOL_SIZE,
+            waitQueueTimeoutMS=Config.MONGO_WAIT_QUEUE_TIMEOUT_MS
+        )
         self.db = self.client[Config.DATABASE_NAME]
-        self._connection_lock = Lock() 
-        self._initialized = True
-        self.setup_indexes()
-
-    # Create indexes for optimising queries for all of the collections
-    def setup_indexes(self):
+        self.schema_version = 0  # Until _check_schema has read it, has_schema_version reads it again
 
+    # Indexes are created by migrate.py, startup only checks that they are up to date
+    def _check_schema(self):
         try:
-            # [Users] collection indexes
-            self.db.Users.create_index([("Username", ASCENDING)], unique=True)
-            self.db.Users.create_index([("Email", ASCENDING)], unique=True)
-            self.db.Users.create_index([("ContactNumber", ASCENDING)])
-
-            # [Patients] collection indexes
-            self.db.Patients.create_index([("NRIC", ASCENDING)], unique=True)
-            self.db.Patients.create_index([("PatientName", TEXT)])  # Text index for name searches
-            self.db.Patients.create_index([("UserID", ASCENDING)])
-
-            # [Appointments] collection indexes
-            self.db.Appointments.create_index([
-                ("appt_date", ASCENDING),
-                ("appt_time", ASCENDING)
-            ])
-            self.db.Appointments.create_index([("patient_id", ASCENDING)])
-            self.db.Appointments.create_index([("appt_status", ASCENDING)])
-
-            # [Medications] collection indexes
-            self.db.Medications.create_index([("name", TEXT)])  # Text index for medication searches
-            self.db.Medications.create_index([("quantity", ASCENDING)])
-
-            # [PatientHistory] collection indexes
-            self.db.PatientHistory.create_index([("patient_id", ASCENDING)])
-            self.db.PatientHistory.create_index([("date", DESCENDING)])  # Decending index to sorting by latest
-            self.db.PatientHistory.create_index([("diagnosis", TEXT)])  # Text index for diagnosis searches
-
-            # [Prescriptions] collection indexes
-            self.db.Prescriptions.create_index([
-                ("patient_id", ASCENDING),
-                ("date", DESCENDING)
-            ])
-
-            logging.info("Successfully created database indexes")
-        except OperationFailure as e:
-            logging.error(f"Failed to create indexes: {str(e)}")
-
-    # Thread-safe method to get database connection
+            self.schema_version = check_schema_version(self.db)
+        except PyMongoError as e:
+            # E.g. the server cannot be reached yet, the version is read again when it is needed
+            logging.error(f"Failed to check schema version: {str(e)}")
+
+    # Get the shared database handle, safe to call from any thread
     def get_db(self):
-        with self._connection_lock:
-            return self.db
+        return self.db
 
-    #Thread-safe atomic update for medication quantities
-    #Returns True if update is successful, False if insufficient quantity
+    # True if the DB has had at least the given migration applied
+    # The version is only read again while it is behind, it never goes back once reached
+    def has_schema_version(self, version):
+        if self.schema_version < version:
+            self.schema_version = get_schema_version(self.db)
+        return self.schema_version >= version
+
+    # Atomic update for medication quantities, the check and the update happen in one DB operation
+    # Returns True if update is successful, False if insufficient quantity
     def atomic_update_medication_quantity(self, medication_id, quantity_change):
-        with self._connection_lock:
-            # Find the medication and check quantity in one atomic operation
-            result = self.db.Medications.find_one_and_update(
+        result = self.db.Medications.find_one_and_update(
+            {
+                "_id": medication_id,
+                "quantity": {"$gte": abs(quantity_change) if quantity_change < 0 else 0}
+            },
+            {"$inc": {"quantity": quantity_change}},
+            return_document=True
+        )
+        return result is not None
+
+    # Prescribe one or more medications for a visit in a single transaction
+    # items is a list of {"name", "dosage", "notes"}. Stock is decremented with the same conditional $gte
+    # check as atomic_update_medication_quantity, so concurrent prescriptions cannot oversell.
+    # Either every item is prescribed or none are.
+    # Returns (True, None) if successful, with the _id of its medication set on each item as med_id,
+    # (False, error message) if nothing was prescribed
+    def atomic_prescribe(self, patient_id, appt_id, items):
+        def prescribe(session):
+            names = list({item["name"] for item in items})
+            med_ids = {
+                med["name"]: med["_id"]
+                for med in self.db.Medications.find({"name": {"$in": names}}, {"name": 1}, session=session)
+            }
+            missing = [name for name in names if name not in med_ids]
+            if missing:
+                raise PrescriptionError(f'Medication not found: {", ".join(missing)}')
+            for item in items:
+                item["med_id"] = med_ids[item["name"]]  # Tells the caller which medication was prescribed
+
+            # One round trip for all stock decrements, each only applies if there is enough stock
+            result = self.db.Medications.bulk_write([
+                UpdateOne(
+                    {"_id": med_ids[item["name"]], "quantity": {"$gte": item["dosage"]}},
+                    {"$inc": {"quantity": -item["dosage"]}}
+                )
+                for item in items
+            ], session=session)
+            if result.modified_count != len(items):
+                raise PrescriptionError('Not enough medication in stock!')
+
+            now = datetime.now()
+            self.db.Prescriptions.insert_many([
+                {
+                    "patient_id": patient_id,
+                    "appt_id": appt_id,
+                    "med_id": med_ids[item["name"]],
+                    "dosage": item["dosage"],
+                    "date": now,
+                    "notes": item["notes"]
+                }
+                for item in items
+            ], session=session)
+            self.db.InventoryLogs.insert_many([
                 {
-                    "_id": medication_id,
-                    "quantity": {"$gte": abs(quantity_change) if quantity_change < 0 else 0}
-                },
-                {"$inc": {"quantity": quantity_change}},
-                return_document=True
-            )
-            return result is not None
-
-    # Thread-safe atomic operation for booking appointments
+                    "med_id": med_ids[item["name"]],
+                    "change_type": 'subtract',
+                    "quantity_changed": item["dosage"],
+                    "date": now
+                }
+                for item in items
+            ], session=session)
+
+        try:
+            with self.client.start_session() as session:
+                session.with_transaction(prescribe)
+            return True, None
+        except PrescriptionError as e:
+            return False, str(e)
+        except PyMongoError as e:
+            # E.g. a write conflict that is still failing after the retries, or a server without transactions
+            logging.error(f"Failed to save prescription for patient {patient_id}: {str(e)}")
+            return False, 'Could not save the prescription, please try again.'
+
+    # Delete the patients matched by patient_filter (a [Patients] query) with everything that belongs to them:
+    # prescriptions, history, appointments, the patient record and the user account.
+    # Patients are deleted batch_size at a time, each batch in its own transaction with one $in delete per
+    # collection, so a batch never leaves orphans behind and purging many patients costs few round trips.
+    # A session runs one operation at a time, so the deletes of a batch are issued one after another.
+    # Returns the number of documents deleted from each collection
+    def cascade_delete_patients(self, patient_filter, batch_size=500):
+        patients = list(self.db.Patients.find(patient_filter, {"_id": 1, "UserID": 1}))
+        totals = {"Prescriptions": 0, "PatientHistory": 0, "Appointments": 0, "Patients": 0, "Users": 0}
+
+        for start in range(0, len(patients), batch_size):
+            batch = patients[start:start + batch_size]
+            patient_ids = [patient["_id"] for patient in batch]
+            user_ids = [patient["UserID"] for patient in batch if patient.get("UserID")]
+            counts = {}
+
+            def delete_batch(session):
+                by_patient = {"patient_id": {"$in": patient_ids}}
+                counts["Prescriptions"] = self.db.Prescriptions.delete_many(by_patient, session=session).deleted_count
+                counts["PatientHistory"] = self.db.PatientHistory.delete_many(by_patient, session=session).deleted_count
+                counts["Appointments"] = self.db.Appointments.delete_many(by_patient, session=session).deleted_count
+                counts["Patients"] = self.db.Patients.delete_many({"_id": {"$in": patient_ids}}, session=session).deleted_count
+                # Never remove a staff account, even if a patient record points at it
+                counts["Users"] = self.db.Users.delete_many(
+                    {"_id": {"$in": user_ids}, "IsStaff": {"$ne": 1}}, session=session
+                ).deleted_count
+
+            with self.client.start_session() as session:
+                session.with_transaction(delete_batch)
+            for collection, deleted in counts.items():
+                totals[collection] += deleted
+
+        return totals
+
+    # Create a user account and, for patients, their patient record in one transaction
+    # Uniqueness is enforced by the unique indexes on Username, Email and NRIC rather than by checking first,
+    # so concurrent registrations cannot both succeed. Raises DuplicateKeyError, nothing is written then.
+    # Returns the new user's _id
+    def register_user(self, user_data, patient_data=None):
+        def register(session):
+            user_id = self.db.Users.insert_one(dict(user_data), session=session).inserted_id
+            if patient_data is not None:
+                self.db.Patients.insert_one(dict(patient_data, UserID=user_id), session=session)
+            return user_id
+
+        with self.client.start_session() as session:
+            return session.with_transaction(register)
+
+    # Register many users with their patient records in one transaction (bulk patient onboarding)
+    # The _id of each user and its patient's UserID are set by the caller, so both can be inserted with insert_many
+    # A taken username, email or NRIC aborts the whole transaction with a BulkWriteError
+    def register_users(self, users, patients):
+        def register(session):
+            self.db.Users.insert_many(users, session=session)
+            self.db.Patients.insert_many(patients, session=session)
+
+        with self.client.start_session() as session:
+            session.with_transaction(register)
+
+    # Atomic operation for booking appointments, safe across threads and worker processes
+    # The unique slot index rejects the insert if the slot has been taken, so no lock or pre-check is needed.
+    # Until migrate.py has created that index, the slot is checked first under a lock, which only keeps
+    # the threads of this process from double booking.
     # Returns True if booking is successful, False if slot has been taken
     def atomic_book_appointment(self, appointment_data):
-        with self._connection_lock:
-            # Check if slot is available and book in one atomic operation
-            existing = self.db.Appointments.find_one({
-                "appt_date": appointment_data["appt_date"],
-                "appt_time": appointment_data["appt_time"]
-            })
-            
-            if existing:
-                return False
-                
+        if not self.has_schema_version(UNIQUE_APPOINTMENT_SLOT_VERSION):
+            with self._booking_lock:
+                existing = self.db.Appointments.find_one({
+                    "appt_date": appointment_data["appt_date"],
+                    "appt_time": appointment_data["appt_time"]
+                }, {"_id": 1})
+                if existing:
+                    return False
+                self.db.Appointments.insert_one(appointment_data)
+                return True
+
+        try:
             self.db.Appointments.insert_one(appointment_data)
             return True
+        except DuplicateKeyError:
+            return False
 
 from db_config import DatabaseManager
 
@@ -0,0 +1,41 @@
+# This file imports a medication catalogue into the DB: python import_medications.py catalogue.csv
+# The file is CSV with a header row, or JSON Lines with one object per line, both with the fields
+# name, form, dosage, quantity and indication. Medications are matched on their name, form and dosage:
+# existing ones are updated, new ones are added with the next MedIDs. Invalid and repeated rows are skipped
+# and listed at the end.
+
+import argparse
+import logging
+import sys
+from config import Config
+from db_config import DatabaseManager
+from medication_import import import_medications, format_from_filename
+
+def main():
+    parser = argparse.ArgumentParser(description="Add or update medications from a CSV or JSON Lines file.")
+    parser.add_argument('path', help="file to import, - for stdin")
+    parser.add_argument('--format', choices=['csv', 'jsonl'], help="defaults to the file extension")
+    parser.add_argument('--batch-size', type=int, default=Config.IMPORT_BATCH_SIZE, help="rows upserted per bulk write")
+    args = parser.parse_args()
+
+    file_format = args.format or format_from_filename(args.path)
+    if file_format is None:
+        parser.error("cannot tell the format from the file name, pass --format")
+
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    db = DatabaseManager().get_db()
+
+    if args.path == '-':
+        report = import_medications(db, sys.stdin, file_format, args.batch_size)
+    else:
+        with open(args.path, newline='', encoding='utf-8-sig') as stream:
+            report = import_medications(db, stream, file_format, args.batch_size)
+
+    print(report.summary())
+    for line_number, message in report.errors:
+        print(f"line {line_number}: {message}")
+    if report.failed > len(report.errors):
+        print(f"... and {report.failed - len(report.errors)} more errors.")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+# This file load tests one route of a running server, to compare the Flask (app.py) and ASGI (asgi.py) modes.
+# Point both at the same local mongod (MONGO_URI=mongodb://localhost:27017), start one of them, then run e.g.
+#     python loadtest.py http://localhost:5000/staff_dashboard --session <session cookie> -c 200 -n 5000
+# Log in as staff in a browser first and copy the value of its "session" cookie.
+# To measure a route during a login storm, also pass e.g.
+#     --storm http://localhost:5000/login --storm-data "username=test&password=test" --storm-concurrency 50
+
+import argparse
+import statistics
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from threading import Event, Thread
+
+def fetch(url, session_cookie, data=None):
+    request = urllib.request.Request(url, data=data)
+    if session_cookie:
+        request.add_header('Cookie', f'session={session_cookie}')
+    started = time.perf_counter()
+    try:
+        with urllib.request.urlopen(request, timeout=60) as response:
+            response.read()
+            ok = response.status == 200
+    except Exception:
+        ok = False
+    return ok, time.perf_counter() - started
+
+# POST the login form over and over until stopped
+def storm(url, data, stop):
+    while not stop.is_set():
+        fetch(url, None, data)
+
+def main():
+    parser = argparse.ArgumentParser(description="Send many concurrent GET requests to one URL and report latency.")
+    parser.add_argument('url')
+    parser.add_argument('--session', default='', help="value of a logged in session cookie")
+    parser.add_argument('-c', '--concurrency', type=int, default=100, help="requests in flight at once")
+    parser.add_argument('-n', '--requests', type=int, default=2000, help="total number of requests")
+    parser.add_argument('--storm', help="URL POSTed to in the background while measuring, e.g. the login page")
+    parser.add_argument('--storm-data', default='', help="urlencoded form sent with every --storm request")
+    parser.add_argument('--storm-concurrency', type=int, default=50, help="--storm requests in flight at once")
+    args = parser.parse_args()
+
+    stop = Event()
+    if args.storm:
+        for _ in range(args.storm_concurrency):
+            Thread(target=storm, args=(args.storm, args.storm_data.encode(), stop), daemon=True).start()
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        results = list(executor.map(lambda _: fetch(args.url, args.session), range(args.requests)))
+    elapsed = time.perf_counter() - started
+    stop.set()
+
+    latencies = sorted(latency * 1000 for ok, latency in results if ok)
+    failed = len(results) - len(latencies)
+    print(f"{len(results)} requests in {elapsed:.1f}s ({len(results) / elapsed:.0f} req/s), {failed} failed")
+    if latencies:
+        percentile = lambda p: latencies[min(len(latencies) - 1, int(len(latencies) * p))]
+        print(f"latency ms: mean {statistics.mean(latencies):.1f}, p50 {percentile(0.5):.1f}, "
+              f"p95 {percentile(0.95):.1f}, p99 {percentile(0.99):.1f}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,141 @@
+# This file loads a medication catalogue from CSV or JSON Lines into the [Medications] collection.
+# Rows are read one at a time and written in batches of unordered upserts keyed on (name, form, dosage), the
+# same name can be sold in several forms and strengths. Only that key of each row is kept to find repeated rows,
+# which are reported as errors, so every row is counted once as added, updated or failed. Existing medications
+# are updated, new ones get a MedID reserved for the whole batch from the MedID counter.
+# Used by import_medications.py and /import_medications.
+
+import csv
+import json
+import time
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+from sequences import med_ids
+
+FIELDS = ("name", "form", "dosage", "quantity", "indication")
+KEY_FIELDS = ("name", "form", "dosage")  # Identify a medication, see migration 8 for their index
+MAX_REPORTED_ERRORS = 1000
+
+# Yield (line number, row dict or None, parse error or None) for each row of a text stream
+def read_rows(stream, file_format):
+    if file_format == "csv":
+        reader = csv.DictReader(stream)
+        for row in reader:
+            yield reader.line_num, row, None
+    else:
+        for line_number, line in enumerate(stream, start=1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError as e:
+                yield line_number, None, f"Invalid JSON: {e}"
+                continue
+            if not isinstance(row, dict):
+                yield line_number, None, "Each line must be a JSON object."
+            else:
+                yield line_number, row, None
+
+# Returns (medication document, None) or (None, error message), with the same rules as the Add Medication form
+def validate_row(row):
+    values = {field: str(row.get(field) if row.get(field) is not None else '').strip() for field in FIELDS}
+    missing = [field for field in FIELDS if not values[field]]
+    if missing:
+        return None, f"Missing {', '.join(missing)}."
+    try:
+        values["quantity"] = int(values["quantity"])
+    except ValueError:
+        return None, "Quantity must be a number."
+    if values["quantity"] < 0:
+        return None, "Quantity cannot be negative."
+    return values, None
+
+class ImportReport:
+    def __init__(self):
+        self.rows = 0
+        self.inserted = 0
+        self.updated = 0
+        self.failed = 0
+        self.errors = []  # (line number, message), only the first MAX_REPORTED_ERRORS are kept
+        self.started = time.perf_counter()
+        self.seconds = 0.0
+
+    def error(self, line_number, message):
+        self.failed += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append((line_number, message))
+
+    def summary(self):
+        rate = self.rows / self.seconds if self.seconds else 0
+        return (f"{self.rows} rows in {self.seconds:.1f}s ({rate:.0f} rows/s): "
+                f"{self.inserted} added, {self.updated} updated, {self.failed} failed.")
+
+# The (name, form, dosage) key of a medication document
+def medication_key(doc):
+    return tuple(doc[field] for field in KEY_FIELDS)
+
+# Upsert one batch of (line number, document) with distinct keys: one $in lookup to see which keys are new,
+# one counter update to reserve their MedIDs and one unordered bulk_write
+def _write_batch(db, batch, report):
+    names = list({doc["name"] for _, doc in batch})
+    projection = {"_id": 0, **{field: 1 for field in KEY_FIELDS}}
+    existing = {medication_key(med) for med in db.Medications.find({"name": {"$in": names}}, projection)}
+    new_keys = [medication_key(doc) for _, doc in batch if medication_key(doc) not in existing]
+    new_ids = dict(zip(new_keys, med_ids.reserve(len(new_keys)))) if new_keys else {}
+
+    operations = [
+        UpdateOne(
+            {field: doc[field] for field in KEY_FIELDS},
+            {
+                "$set": {"quantity": doc["quantity"], "indication": doc["indication"]},
+                "$setOnInsert": {"MedID": new_ids.get(medication_key(doc))}
+            },
+            upsert=True
+        )
+        for _, doc in batch
+    ]
+    try:
+        result = db.Medications.bulk_write(operations, ordered=False)
+    except BulkWriteError as e:
+        result = None
+        details = e.details
+        for error in details.get("writeErrors", []):
+            report.error(batch[error["index"]][0], error.get("errmsg", "Write failed."))
+        report.inserted += details.get("nUpserted", 0)
+        report.updated += details.get("nMatched", 0)
+    if result is not None:
+        report.inserted += result.upserted_count
+        report.updated += result.matched_count
+
+# Import every row of a text stream, writing batch_size rows at a time. Returns the ImportReport.
+# Pass a report to still have the counts of the batches already written if the import fails part way.
+def import_medications(db, stream, file_format, batch_size, report=None):
+    report = report or ImportReport()
+    batch = []
+    seen = {}  # (name, form, dosage) -> line number of its first row
+    try:
+        for line_number, row, error in read_rows(stream, file_format):
+            report.rows += 1
+            if error is None:
+                doc, error = validate_row(row)
+            if error is None and medication_key(doc) in seen:
+                error = f"Same name, form and dosage as line {seen[medication_key(doc)]}."
+            if error:
+                report.error(line_number, error)
+                continue
+            seen[medication_key(doc)] = line_number
+            batch.append((line_number, doc))
+            if len(batch) >= batch_size:
+                _write_batch(db, batch, report)
+                batch = []
+        if batch:
+            _write_batch(db, batch, report)
+    finally:
+        report.seconds = time.perf_counter() - report.started
+    return report
+
+# csv or jsonl from a file name, None if the extension is not supported
+# A .json file is usually one JSON array rather than JSON Lines, so it is not accepted
+def format_from_filename(filename):
+    extension = filename.rsplit('.', 1)[-1].lower() if '.' in filename else ''
+    return {"csv": "csv", "jsonl": "jsonl", "ndjson": "jsonl"}.get(extension)
@@ -0,0 +1,146 @@
+# This file keeps an in-memory autocomplete index of medication names.
+# The typeahead on the Medication List and Prescribe Medication pages looks names up here
+# instead of running a regex over the [Medications] collection on every keystroke.
+
+import logging
+import re
+import time
+from bisect import bisect_left, insort
+from threading import Lock, Thread
+from config import Config
+from db import get_db_connection
+from cache import TTLCache
+
+# Word boundaries inside a name, so "chlor" also finds "Sodium Chloride"
+WORD_START = re.compile(r'(?<=[\s\-/(,])\w')
+
+def normalise(text):
+    return text.strip().lower()
+
+class MedicationIndex:
+    def __init__(self, get_db, refresh_interval, cache=None):
+        self._get_db = get_db
+        self.refresh_interval = refresh_interval
+        self.cache = cache  # Response cache invalidated whenever the index changes
+        self._keys = []  # Sorted (key, name, _id) tuples, one per word start of each name
+        self._quantities = {}  # _id -> quantity in stock, names are not unique (e.g. different forms or dosages)
+        self._lock = Lock()
+        self._loaded_at = None
+        self._refreshing = False
+
+    @staticmethod
+    def _keys_for(medication_id, name):
+        lowered = normalise(name)
+        keys = [lowered]
+        keys.extend(lowered[match.start():] for match in WORD_START.finditer(lowered))
+        return [(key, name, medication_id) for key in keys]
+
+    # (Re)build the index from the DB. Other workers' changes are picked up on the next refresh.
+    def load(self):
+        db = self._get_db()
+        keys = []
+        quantities = {}
+        for medication in db.Medications.find({}, {"name": 1, "quantity": 1}):
+            name = medication.get('name')
+            if not name:
+                continue
+            keys.extend(self._keys_for(medication['_id'], name))
+            quantities[medication['_id']] = medication.get('quantity', 0)
+        keys.sort()
+
+        with self._lock:
+            self._keys = keys
+            self._quantities = quantities
+            self._loaded_at = time.monotonic()
+        self._invalidate()
+        logging.info(f"Loaded {len(quantities)} medications into the autocomplete index")
+
+    # Load the index in the background so app startup does not wait for the DB
+    def start(self):
+        self._refresh_in_background()
+
+    def _refresh_in_background(self):
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+
+        def refresh():
+            try:
+                self.load()
+            except Exception as e:
+                logging.error(f"Failed to load the medication autocomplete index: {str(e)}")
+            finally:
+                with self._lock:
+                    self._refreshing = False
+
+        Thread(target=refresh, daemon=True).start()
+
+    def _invalidate(self):
+        if self.cache is not None:
+            self.cache.bump()
+
+    def add(self, medication_id, name, quantity):
+        with self._lock:
+            for key in self._keys_for(medication_id, name):
+                insort(self._keys, key)
+            self._quantities[medication_id] = quantity
+        self._invalidate()
+
+    def remove(self, medication_id, name):
+        with self._lock:
+            for key in self._keys_for(medication_id, name):
+                i = bisect_left(self._keys, key)
+                if i < len(self._keys) and self._keys[i] == key:
+                    del self._keys[i]
+            self._quantities.pop(medication_id, None)
+        self._invalidate()
+
+    def adjust_quantity(self, medication_id, quantity_change):
+        with self._lock:
+            if medication_id in self._quantities:
+                self._quantities[medication_id] += quantity_change
+        self._invalidate()
+
+    # Return up to limit medications whose name, or a word in it, starts with the query
+    def search(self, query, limit=20):
+        prefix = normalise(query)
+        if not prefix:
+            return []
+
+        if self._loaded_at is None:
+            # The startup load has not finished yet. Lookups never wait for the DB, they find nothing
+            # until it is done; the load bumps the cache so these empty results are not kept.
+            self._refresh_in_background()
+            return []
+        if time.monotonic() - self._loaded_at > self.refresh_interval:
+            self._refresh_in_background()
+
+        # One result per medication, several medications can share a name
+        results = []
+        seen = set()
+        with self._lock:
+            i = bisect_left(self._keys, (prefix,))
+            while i < len(self._keys) and len(results) < limit:
+                key, name, medication_id = self._keys[i]
+                if not key.startswith(prefix):
+                    break
+                if medication_id not in seen:
+                    seen.add(medication_id)
+                    results.append({"name": name, "quantity": self._quantities.get(medication_id, 0)})
+                i += 1
+        return results
+
+# Typeahead responses are the same for every staff session, so they are cached by normalised query
+typeahead_cache = TTLCache(maxsize=Config.TYPEAHEAD_CACHE_SIZE, ttl=Config.TYPEAHEAD_CACHE_TTL)
+medication_index = MedicationIndex(get_db_connection, Config.MEDICATION_INDEX_REFRESH, cache=typeahead_cache)
+
+# Cached lookup used by the /search_medications routes
+def search_medications(query, limit=20):
+    key = (normalise(query), limit)
+    results = typeahead_cache.get(key)
+    if results is None:
+        generation = typeahead_cache.generation
+        results = medication_index.search(query, limit)
+        typeahead_cache.set(key, results, generation)
+    return results
@@ -0,0 +1,40 @@
+# This file applies the schema migrations in migrations.py to the DB.
+# Run it once per deployment, before starting the app: python migrate.py
+# It does nothing if the DB is already at the latest version. Use --status to only print the version.
+# --backfill-diagnoses recomputes the latest diagnosis stored on every patient from [PatientHistory].
+
+import argparse
+import logging
+from db_config import DatabaseManager
+from migrations import apply_migrations, get_schema_version, SCHEMA_VERSION
+from patient_history import backfill_latest_diagnoses
+
+def main():
+    parser = argparse.ArgumentParser(description="Apply pending DB schema migrations.")
+    parser.add_argument('--status', action='store_true', help="print the current schema version and exit")
+    parser.add_argument('--backfill-diagnoses', action='store_true',
+                        help="recompute the latest diagnosis of every patient and exit")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    db = DatabaseManager().get_db()
+
+    if args.backfill_diagnoses:
+        updated = backfill_latest_diagnoses(db)
+        print(f"Updated the latest diagnosis of {updated} patients.")
+        return
+
+    current = get_schema_version(db)
+    if args.status:
+        print(f"Schema version {current}, latest is {SCHEMA_VERSION}.")
+        return
+
+    if current >= SCHEMA_VERSION:
+        print(f"Schema is up to date (version {current}).")
+        return
+
+    version = apply_migrations(db)
+    print(f"Schema migrated from version {current} to {version}.")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,152 @@
+# This file holds the versioned schema migrations (indexes and data fixes) for our DB.
+# Migrations are applied by running migrate.py, not by the app, so workers start without touching indexes.
+# To change the schema, append a new migration to MIGRATIONS. Never edit one that has already been applied.
+
+from datetime import datetime
+from pymongo import ASCENDING, DESCENDING, TEXT
+from patient_history import backfill_latest_diagnoses
+import logging
+
+# Create indexes for optimising queries for all of the collections
+def create_initial_indexes(db):
+    # [Users] collection indexes
+    db.Users.create_index([("Username", ASCENDING)], unique=True)
+    db.Users.create_index([("Email", ASCENDING)], unique=True)
+    db.Users.create_index([("ContactNumber", ASCENDING)])
+
+    # [Patients] collection indexes
+    db.Patients.create_index([("NRIC", ASCENDING)], unique=True)
+    db.Patients.create_index([("PatientName", TEXT)])  # Text index for name searches
+    db.Patients.create_index([("UserID", ASCENDING)])
+
+    # [Appointments] collection indexes, the slot index is created by create_unique_appointment_slot_index
+    db.Appointments.create_index([("patient_id", ASCENDING)])
+    db.Appointments.create_index([("appt_status", ASCENDING)])
+
+    # [Medications] collection indexes
+    db.Medications.create_index([("name", TEXT)])  # Text index for medication searches
+    db.Medications.create_index([("quantity", ASCENDING)])
+
+    # [PatientHistory] collection indexes
+    db.PatientHistory.create_index([("patient_id", ASCENDING)])
+    db.PatientHistory.create_index([("date", DESCENDING)])  # Decending index to sorting by latest
+    db.PatientHistory.create_index([("diagnosis", TEXT)])  # Text index for diagnosis searches
+
+    # [Prescriptions] collection indexes
+    db.Prescriptions.create_index([("patient_id", ASCENDING), ("date", DESCENDING)])
+
+# Keyset pagination of the Medication List
+def create_medication_name_index(db):
+    db.Medications.create_index([("name", ASCENDING), ("_id", ASCENDING)])
+
+# Unique index on the appointment slot, so the DB itself rejects a second booking for the same slot
+# Replaces the older non-unique index on the same keys if an existing DB still has it. The unique index is
+# built first and the old one dropped after, so slot queries always have an index to use. The DB does not
+# allow two indexes that only differ in uniqueness, so the unique one gets a partial filter every
+# appointment matches, which makes it a different index with the same keys and the same effect.
+def create_unique_appointment_slot_index(db):
+    keys = [("appt_date", ASCENDING), ("appt_time", ASCENDING)]
+    existing = [(name, info) for name, info in db.Appointments.index_information().items() if info["key"] == keys]
+    if any(info.get("unique") for _, info in existing):
+        return
+
+    # Existing double bookings have to be resolved before the slot can be enforced, the old index is
+    # kept if this fails
+    db.Appointments.create_index(keys, unique=True, name="appt_slot_unique",
+                                 partialFilterExpression={"appt_date": {"$exists": True}})
+    for name, _ in existing:
+        db.Appointments.drop_index(name)
+
+# Denormalised latest diagnosis on [Patients], so diagnosis filters do not need to join [PatientHistory]
+def add_latest_diagnosis(db):
+    db.Patients.create_index([("latest_diagnosis", ASCENDING)])
+    db.Patients.create_index([("latest_diagnosis_date", DESCENDING)])
+    updated = backfill_latest_diagnoses(db)
+    logging.info(f"Backfilled the latest diagnosis of {updated} patients")
+
+# Lowercase shadow fields for the anchored username / email / NRIC searches
+# Backfilled with a pipeline update, one round trip per collection
+def add_search_shadow_fields(db):
+    db.Users.update_many({}, [{"$set": {
+        "UsernameLower": {"$toLower": "$Username"},
+        "EmailLower": {"$toLower": "$Email"}
+    }}])
+    db.Patients.update_many({}, [{"$set": {"NRICLower": {"$toLower": "$NRIC"}}}])
+
+    db.Users.create_index([("UsernameLower", ASCENDING)])
+    db.Users.create_index([("EmailLower", ASCENDING)])
+    db.Patients.create_index([("NRICLower", ASCENDING)])
+
+# Diagnoses of a visit were once saved as upserts on (patient_id, appt_id) from the Edit Patient page, they are
+# now updated by their _id. Not unique: a visit can have more than one diagnosis recorded from the View Patient page
+def create_patient_history_appointment_index(db):
+    db.PatientHistory.create_index([("patient_id", ASCENDING), ("appt_id", ASCENDING)])
+
+# Highest MedID in [Medications], 0 if there is none. Also seeds the counter if this migration has not run.
+def highest_med_id(db):
+    last = db.Medications.find_one({"MedID": {"$type": "number"}}, {"MedID": 1}, sort=[("MedID", DESCENDING)])
+    return last["MedID"] if last else 0
+
+# MedID is allocated from the [Counters] collection (see sequences.py), started after the highest existing MedID
+# $max never moves the counter backwards, so re-running this is safe
+def create_med_id_counter(db):
+    db.Medications.create_index([("MedID", ASCENDING)])
+    db.Counters.update_one({"_id": "MedID"}, {"$max": {"value": highest_med_id(db)}}, upsert=True)
+
+# Medications are identified by (name, form, dosage) when a catalogue is imported (see medication_import.py)
+# Not unique: medications added by hand before this may already repeat a key
+def create_medication_identity_index(db):
+    db.Medications.create_index([("name", ASCENDING), ("form", ASCENDING), ("dosage", ASCENDING)])
+
+# (version, description, function) in the order they are applied
+MIGRATIONS = [
+    (1, "Initial collection indexes", create_initial_indexes),
+    (2, "Medications (name, _id) index for keyset pagination", create_medication_name_index),
+    (3, "Unique appointment slot index", create_unique_appointment_slot_index),
+    (4, "Latest diagnosis on Patients, indexed and backfilled", add_latest_diagnosis),
+    (5, "Lowercase shadow fields for anchored identifier searches", add_search_shadow_fields),
+    (6, "PatientHistory (patient_id, appt_id) index for diagnosis upserts", create_patient_history_appointment_index),
+    (7, "MedID index and counter", create_med_id_counter),
+    (8, "Medications (name, form, dosage) index for catalogue imports", create_medication_identity_index),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+# Migration that creates the unique Username, Email and NRIC indexes, registration relies on them
+# to reject duplicate accounts
+UNIQUE_ACCOUNT_INDEXES_VERSION = 1
+
+# Migration that creates the unique appointment slot index, booking relies on it to reject double bookings
+UNIQUE_APPOINTMENT_SLOT_VERSION = 3
+
+# The applied version is kept in a single document in the [SchemaVersion] collection
+def get_schema_version(db):
+    doc = db.SchemaVersion.find_one({"_id": "schema"})
+    return doc["version"] if doc else 0
+
+# Apply every migration newer than the stored version, recording the version after each one
+# Every step is idempotent, so re-running after a failure is safe
+def apply_migrations(db):
+    current = get_schema_version(db)
+    for version, description, migrate in MIGRATIONS:
+        if version <= current:
+            continue
+        logging.info(f"Applying migration {version}: {description}")
+        migrate(db)
+        db.SchemaVersion.update_one(
+            {"_id": "schema"},
+            {"$set": {"version": version, "updated_at": datetime.now()}},
+            upsert=True
+        )
+        current = version
+    return current
+
+# Cheap startup check: one find_one, and a warning if migrate.py still needs to be run
+def check_schema_version(db):
+    current = get_schema_version(db)
+    if current < SCHEMA_VERSION:
+        logging.warning(
+            f"Database schema is at version {current}, the app expects version {SCHEMA_VERSION}. "
+            f"Run 'python migrate.py' to apply the missing migrations."
+        )
+    return current
@@ -0,0 +1,49 @@
+# This file registers many patients at once from a CSV file: python onboard_patients.py patients.csv
+# The CSV has a header row with the register form fields: username, email, password, address, contact_number,
+# name, nric, gender and dob. Rows without a password get a random one, written to --passwords-out if given,
+# otherwise staff set it from the Edit Patient page. Invalid rows and rows whose username, email or NRIC
+# is already registered are skipped and listed at the end. See patient_onboarding.py.
+# Progress is saved to <file>.checkpoint after every chunk. Run the same command again to resume an
+# interrupted import. The checkpoint is removed when the whole file is done.
+# Set HASH_WORKERS to the number of CPU cores for this run, password hashing is the slowest step.
+
+import argparse
+import logging
+import sys
+from config import Config
+from db_config import DatabaseManager
+from migrations import UNIQUE_ACCOUNT_INDEXES_VERSION
+from patient_onboarding import onboard_patients
+
+def main():
+    parser = argparse.ArgumentParser(description="Register the patients of a CSV file.")
+    parser.add_argument('path', help="CSV file to import")
+    parser.add_argument('--chunk-size', type=int, default=Config.ONBOARD_CHUNK_SIZE,
+                        help="patients inserted per transaction")
+    parser.add_argument('--checkpoint', help="checkpoint file, defaults to <path>.checkpoint")
+    parser.add_argument('--passwords-out', help="append username,password of every generated password to this CSV")
+    args = parser.parse_args()
+    checkpoint = args.checkpoint or args.path + ".checkpoint"
+
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    db_manager = DatabaseManager()
+    # Duplicates that slip past the lookups are only rejected by the unique indexes
+    if not db_manager.has_schema_version(UNIQUE_ACCOUNT_INDEXES_VERSION):
+        sys.exit("The unique account indexes are missing, run 'python migrate.py' first.")
+
+    passwords_file = open(args.passwords_out, 'a', newline='') if args.passwords_out else None
+    try:
+        with open(args.path, newline='', encoding='utf-8-sig') as stream:
+            report = onboard_patients(db_manager, stream, args.chunk_size, checkpoint, passwords_file)
+    finally:
+        if passwords_file is not None:
+            passwords_file.close()
+
+    print(report.summary())
+    for line_number, message in report.errors:
+        print(f"line {line_number}: {message}")
+    if report.failed > len(report.errors):
+        print(f"... and {report.failed - len(report.errors)} more rows skipped, some in earlier runs.")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+# This file handles keyset (seek) pagination for listings.
+# Instead of skip/limit, each page seeks past the last key of the previous page using an index,
+# so page N costs the same as page 1. Cursors are passed to the browser as opaque tokens.
+
+import base64
+import binascii
+from bson import json_util
+
+# Encode the sort key values of a boundary document and the direction of travel into a token
+def encode_cursor(values, direction):
+    raw = json_util.dumps({"v": list(values), "d": direction})
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+# Decode a cursor token back into (values, direction)
+# Returns None when there is no token and raises ValueError when the token has been tampered with
+def decode_cursor(token):
+    if not token:
+        return None
+    try:
+        data = json_util.loads(base64.urlsafe_b64decode(token.encode()).decode())
+        values, direction = data["v"], data["d"]
+    except (binascii.Error, UnicodeDecodeError, KeyError, TypeError, ValueError):
+        raise ValueError("Invalid page cursor.")
+    if direction not in ("next", "prev") or not isinstance(values, list):
+        raise ValueError("Invalid page cursor.")
+    return values, direction
+
+# Build the $match/$sort stages that seek past the cursor on the given sort fields.
+# fields is a list of field paths, ending with a unique one (normally _id) so the order is stable.
+def seek_stages(fields, cursor):
+    if cursor is None:
+        return [{"$sort": {field: 1 for field in fields}}]
+
+    values, direction = cursor
+    op, order = ("$gt", 1) if direction == "next" else ("$lt", -1)
+
+    # (a, b) > (x, y)  <=>  a > x OR (a == x AND b > y)
+    clauses = []
+    for i, field in enumerate(fields):
+        clause = {fields[j]: values[j] for j in range(i)}
+        clause[field] = {op: values[i]}
+        clauses.append(clause)
+    seek = clauses[0] if len(clauses) == 1 else {"$or": clauses}
+
+    return [{"$match": seek}, {"$sort": {field: order for field in fields}}]
+
+# Trim the page_size + 1 documents fetched for a page and work out the next/prev cursors.
+# key returns the sort key values of a document, in the same order as the fields passed to seek_stages.
+def build_page(docs, cursor, page_size, key):
+    direction = cursor[1] if cursor else "next"
+    has_more = len(docs) > page_size
+    docs = docs[:page_size]
+
+    if direction == "prev":
+        # Rows were fetched walking backwards, put them back in display order
+        docs.reverse()
+        has_next, has_prev = True, has_more
+    else:
+        has_next, has_prev = has_more, cursor is not None
+
+    next_cursor = encode_cursor(key(docs[-1]), "next") if docs and has_next else None
+    prev_cursor = encode_cursor(key(docs[0]), "prev") if docs and has_prev else None
+    return docs, next_cursor, prev_cursor
@@ -0,0 +1,110 @@
+# This file hashes and checks passwords in a separate pool of worker processes.
+# PBKDF2 is deliberately slow, and running it on the request thread holds the GIL and stalls every other route
+# of the worker during a burst of logins. The pool is bounded: when too many hashes are already queued,
+# or one takes longer than the timeout, HashingBusy is raised and the route asks the user to try again.
+
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from threading import BoundedSemaphore, Lock, Thread
+from werkzeug.security import generate_password_hash, check_password_hash
+from config import Config
+
+# Raised when the hashing pool is full or too slow, the message is shown to the user
+class HashingBusy(Exception):
+    def __init__(self):
+        super().__init__('The server is busy, please try again in a moment.')
+
+_pool = None
+_pool_lock = Lock()
+
+# Hashes running or queued in the pool, a slot is only given back when its hash has finished
+_slots = BoundedSemaphore(Config.HASH_WORKERS + Config.HASH_QUEUE_SIZE)
+
+# Started on first use, so importing this file does not spawn processes
+# The workers are spawned rather than forked: forking a worker that already runs the DB client's
+# monitor threads and the medication index thread can copy locks held by them into the child
+def _get_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ProcessPoolExecutor(max_workers=Config.HASH_WORKERS,
+                                            mp_context=multiprocessing.get_context('spawn'))
+    return _pool
+
+# A pool stays broken once one of its workers has died (e.g. killed for using too much memory),
+# so it is replaced by a new one on the next hash
+def _replace_pool(broken):
+    global _pool
+    with _pool_lock:
+        if _pool is broken:
+            _pool = None
+    broken.shutdown(wait=False, cancel_futures=True)
+
+# timeout is how long to wait for a free slot, None waits as long as it takes
+def _submit(function, *args, timeout=Config.HASH_TIMEOUT):
+    if not _slots.acquire(timeout=timeout):
+        raise HashingBusy()
+    try:
+        pool = _get_pool()
+        try:
+            future = pool.submit(function, *args)
+        except BrokenProcessPool:
+            logging.error("A password hashing worker died, starting a new pool")
+            _replace_pool(pool)
+            future = _get_pool().submit(function, *args)
+    except BaseException:
+        # Nothing was queued, give the slot back
+        _slots.release()
+        raise
+    future.add_done_callback(lambda _: _slots.release())
+    return future
+
+def _run(function, *args):
+    future = _submit(function, *args)
+    try:
+        return future.result(timeout=Config.HASH_TIMEOUT)
+    except TimeoutError:
+        future.cancel()
+        raise HashingBusy()
+    except BrokenProcessPool:
+        # The worker died during this hash, the pool is replaced on the next submit
+        raise HashingBusy()
+
+def hash_password(password):
+    return _run(generate_password_hash, password, Config.PASSWORD_HASH_METHOD)
+
+def verify_password(password_hash, password):
+    return _run(check_password_hash, password_hash, password)
+
+# Hash many passwords at once (bulk patient onboarding), spread over all the pool's workers.
+# Waits for free slots instead of raising HashingBusy, so a long batch is not cut short. Returns the hashes in order.
+def hash_passwords(passwords):
+    futures = [_submit(generate_password_hash, password, Config.PASSWORD_HASH_METHOD, timeout=None)
+               for password in passwords]
+    return [future.result() for future in futures]
+
+# True if the stored hash was made with a different method or cost than PASSWORD_HASH_METHOD
+def needs_rehash(password_hash):
+    return password_hash.split('$', 1)[0] != Config.PASSWORD_HASH_METHOD
+
+# After a successful login, replace a hash made with an old cost without making the user wait.
+# Skipped when the pool is busy, it is tried again on the next login.
+def rehash_in_background(db, user_id, old_hash, password):
+    try:
+        future = _submit(generate_password_hash, password, Config.PASSWORD_HASH_METHOD, timeout=0)
+    except HashingBusy:
+        return
+
+    def store(done):
+        try:
+            # Only replace the hash that was checked, in case the password was changed in the meantime
+            db.Users.update_one({"_id": user_id, "Password": old_hash}, {"$set": {"Password": done.result()}})
+        except Exception as e:
+            logging.error(f"Failed to rehash the password of user {user_id}: {str(e)}")
+
+    # Done callbacks run on the pool's thread that hands out every result, so the DB write is
+    # made on its own thread instead of holding up the other hashes
+    future.add_done_callback(lambda done: Thread(target=store, args=(done,), daemon=True).start())
@@ -0,0 +1,124 @@
+# This file keeps the latest diagnosis stored on each [Patients] document up to date.
+# latest_diagnosis / latest_diagnosis_date are copied from [PatientHistory] when it is written,
+# so the staff dashboard and advanced search can filter on them without joining the history.
+
+from datetime import datetime
+from pymongo import UpdateOne
+
+# Record a new diagnosis as the patient's latest, unless a later one is already stored
+# One conditional update, safe to run concurrently with other writers
+def record_latest_diagnosis(db, patient_id, diagnosis, date):
+    db.Patients.update_one(
+        {
+            "_id": patient_id,
+            "$or": [{"latest_diagnosis_date": None}, {"latest_diagnosis_date": {"$lte": date}}]
+        },
+        {"$set": {"latest_diagnosis": diagnosis, "latest_diagnosis_date": date}}
+    )
+
+# Recompute the latest diagnosis from the history, used after past diagnoses have been edited
+def refresh_latest_diagnosis(db, patient_id):
+    latest = db.PatientHistory.find_one(
+        {"patient_id": patient_id},
+        {"diagnosis": 1, "date": 1},
+        sort=[("date", -1)]
+    )
+    if latest:
+        db.Patients.update_one(
+            {"_id": patient_id},
+            {"$set": {"latest_diagnosis": latest.get("diagnosis", ""), "latest_diagnosis_date": latest.get("date")}}
+        )
+    else:
+        db.Patients.update_one({"_id": patient_id}, {"$unset": {"latest_diagnosis": "", "latest_diagnosis_date": ""}})
+
+# Populate latest_diagnosis for every patient from the existing history, in batches
+# Returns the number of patients updated
+def backfill_latest_diagnoses(db, batch_size=1000):
+    pipeline = [
+        {"$sort": {"patient_id": 1, "date": -1}},
+        {"$group": {
+            "_id": "$patient_id",
+            "diagnosis": {"$first": "$diagnosis"},
+            "date": {"$first": "$date"}
+        }}
+    ]
+
+    updated = 0
+    batch = []
+    for latest in db.PatientHistory.aggregate(pipeline, allowDiskUse=True):
+        batch.append(UpdateOne(
+            {"_id": latest["_id"]},
+            {"$set": {"latest_diagnosis": latest.get("diagnosis") or "", "latest_diagnosis_date": latest.get("date")}}
+        ))
+        if len(batch) >= batch_size:
+            updated += db.Patients.bulk_write(batch, ordered=False).modified_count
+            batch = []
+    if batch:
+        updated += db.Patients.bulk_write(batch, ordered=False).modified_count
+    return updated
+
+# Save the diagnoses edited on the Edit Patient page in one ordered bulk_write
+# rows is a list of {"history_id", "diagnosis", "date", "notes"}, one per [PatientHistory] record shown on the page;
+# existing is the patient's history as already loaded, and rows that match their record are skipped.
+# A visit can have several diagnoses, so rows are matched and written by the record's _id, never by appt_id.
+# Returns the number of rows written.
+def save_diagnoses(db, patient_id, rows, existing):
+    current = {record["_id"]: record for record in existing}
+
+    updates = []
+    for row in rows:
+        record = current.get(row["history_id"])
+        if record is None:
+            # Not one of this patient's records, or deleted since the page was loaded
+            continue
+        date = row["date"]
+        # The form only has the day, records added from View Patient also have a time. A stored date on
+        # the same day is kept as it is, so an unchanged row is skipped and its time is not lost.
+        if isinstance(record.get("date"), datetime) and record["date"].date() == date.date():
+            date = record["date"]
+        if record.get("diagnosis") == row["diagnosis"] and record.get("notes") == row["notes"] \
+                and record.get("date") == date:
+            continue
+        updates.append(UpdateOne(
+            {"_id": row["history_id"], "patient_id": patient_id},
+            {"$set": {"diagnosis": row["diagnosis"], "date": date, "notes": row["notes"]}}
+        ))
+
+    if updates:
+        db.PatientHistory.bulk_write(updates, ordered=True)
+    return len(updates)
+
+# Prescriptions of a patient with the name of each medication, for the View Patient page
+def past_prescriptions_pipeline(patient_id):
+    return [
+        {"$match": {"patient_id": patient_id}},
+        {"$lookup": {
+            "from": "Medications",
+            "localField": "med_id",
+            "foreignField": "_id",
+            "as": "medication_details"
+        }},
+        {"$unwind": "$medication_details"},
+        {"$project": {
+            "prescription_id": "$_id",
+            "medication_name": "$medication_details.name",
+            "dosage": 1,
+            "date": 1,
+            "notes": 1
+        }}
+    ]
+
+# Format the date of each history or prescription record to YYYY-MM-DD, in place
+def format_record_dates(records):
+    for record in records:
+        if 'date' in record:
+            if isinstance(record['date'], datetime):
+                record['date'] = record['date'].strftime('%Y-%m-%d')
+            elif isinstance(record['date'], str):
+                try:
+                    # Try to parse the string date and format it
+                    date_obj = datetime.strptime(record['date'], '%Y-%m-%d')
+                    record['date'] = date_obj.strftime('%Y-%m-%d')
+                except ValueError:
+                    record['date'] = record['date']  # Keep original string if parsing fails
+    return records
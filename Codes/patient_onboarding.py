@@ -0,0 +1,199 @@
+# This file onboards many patients at once, e.g. the records of a partner clinic (see onboard_patients.py).
+# The CSV has the fields of the register form. It is read in chunks, and each chunk is:
+#   1. validated a column at a time with the precompiled checks of utils.py, including the NRIC checksum
+#   2. checked against the DB with one $in lookup per unique field (username, email, NRIC), run concurrently
+#   3. given password hashes from the hashing process pool, all workers at once
+#   4. inserted with insert_many into [Users] and [Patients] in one transaction
+# After each chunk the number of rows done is saved to a checkpoint file, so an interrupted run resumes
+# after the last committed chunk. Rows of a chunk that committed before its checkpoint was saved are
+# reported as duplicates on the next run rather than inserted twice.
+
+import csv
+import json
+import os
+import secrets
+import time
+from bson.objectid import ObjectId
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+from db_config import duplicate_key_field
+from password_hashing import hash_passwords
+from patient_search import add_search_fields
+from uniqueness import UNIQUE_FIELDS, run_concurrently
+from utils import is_valid_sg_address, is_valid_sg_phone, is_valid_nric_checksum
+
+FIELDS = ("username", "email", "password", "address", "contact_number", "name", "nric", "gender", "dob")
+REQUIRED = ("username", "email", "nric")
+MAX_REPORTED_ERRORS = 1000
+
+# Optional fields are only checked when they are filled in, like on the register form
+CHECKS = (
+    ("address", is_valid_sg_address, "Invalid Singapore address, it needs a 6-digit postal code."),
+    ("contact_number", is_valid_sg_phone, "Invalid Singapore phone number."),
+    ("nric", is_valid_nric_checksum, "Invalid NRIC, wrong format or check letter."),
+)
+
+# CSV column -> (collection, unique field)
+UNIQUE_COLUMNS = {"username": ("Users", "Username"), "email": ("Users", "Email"), "nric": ("Patients", "NRIC")}
+
+class OnboardingReport:
+    def __init__(self, rows=0, inserted=0, failed=0):
+        self.rows = rows
+        self.inserted = inserted
+        self.failed = failed
+        self.errors = []  # (line number, message), only the first MAX_REPORTED_ERRORS of this run are kept
+        self.started = time.perf_counter()
+
+    def error(self, line_number, message):
+        self.failed += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append((line_number, message))
+
+    def summary(self):
+        seconds = time.perf_counter() - self.started
+        return f"{self.rows} rows done ({seconds:.1f}s this run): {self.inserted} patients added, {self.failed} skipped."
+
+def load_checkpoint(path):
+    if not os.path.exists(path):
+        return {"rows": 0, "inserted": 0, "failed": 0}
+    with open(path) as f:
+        return json.load(f)
+
+# Written to a temporary file first, so a crash while saving never leaves a broken checkpoint
+def save_checkpoint(path, report):
+    with open(path + ".tmp", "w") as f:
+        json.dump({"rows": report.rows, "inserted": report.inserted, "failed": report.failed}, f)
+    os.replace(path + ".tmp", path)
+
+# Yield lists of (line number, row) of up to chunk_size rows, after skipping the first skip rows
+def read_chunks(stream, chunk_size, skip=0):
+    reader = csv.DictReader(stream)
+    chunk = []
+    for index, row in enumerate(reader):
+        if index < skip:
+            continue
+        chunk.append((reader.line_num, row))
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+# Validate a chunk a column at a time. Returns ({field: [values]}, [[errors of each row]])
+def validate_columns(rows):
+    # Passwords are kept exactly as given, like on the register form
+    columns = {field: [(row.get(field) or '').strip() for row in rows] for field in FIELDS if field != "password"}
+    columns["password"] = [row.get("password") or '' for row in rows]
+    columns["nric"] = [nric.upper() for nric in columns["nric"]]
+    errors = [[] for _ in rows]
+
+    for field in REQUIRED:
+        for i, value in enumerate(columns[field]):
+            if not value:
+                errors[i].append(f"Missing {field}.")
+
+    for field, check, message in CHECKS:
+        for i, (value, ok) in enumerate(zip(columns[field], map(check, columns[field]))):
+            if value and not ok:
+                errors[i].append(message)
+
+    # Only the first row of the chunk may use a value, later ones are duplicates within the file
+    for column in UNIQUE_COLUMNS:
+        seen = set()
+        for i, value in enumerate(columns[column]):
+            if value and value in seen:
+                errors[i].append(f"{column} appears more than once in the file.")
+            seen.add(value)
+    return columns, errors
+
+# Values of each unique column of the chunk that are already taken, one $in lookup per column
+def taken_values(db, columns, rows):
+    def lookup(column):
+        collection, field = UNIQUE_COLUMNS[column]
+        values = [columns[column][i] for i in rows]
+        return column, {doc[field] for doc in db[collection].find({field: {"$in": values}}, {"_id": 0, field: 1})}
+
+    return dict(run_concurrently(*[lambda column=column: lookup(column) for column in UNIQUE_COLUMNS]))
+
+def build_documents(columns, i, password_hash):
+    value = lambda field: columns[field][i] or None
+    user = add_search_fields({
+        "_id": ObjectId(),
+        "Username": columns["username"][i],
+        "Email": columns["email"][i],
+        "Password": password_hash,
+        "Address": value("address"),
+        "ContactNumber": value("contact_number"),
+        "IsStaff": 0
+    })
+    patient = add_search_fields({
+        "PatientName": value("name"),
+        "NRIC": columns["nric"][i],
+        "PatientGender": value("gender"),
+        "PatientHeight": None,
+        "PatientWeight": None,
+        "PatientDOB": value("dob"),
+        "UserID": user["_id"]
+    })
+    return user, patient
+
+# Validate, dedupe, hash and insert one chunk. Returns [(username, password)] of the placeholder passwords given out.
+def onboard_chunk(db_manager, chunk, report):
+    db = db_manager.get_db()
+    line_numbers = [line_number for line_number, _ in chunk]
+    columns, errors = validate_columns([row for _, row in chunk])
+
+    valid = [i for i in range(len(chunk)) if not errors[i]]
+    if valid:
+        taken = taken_values(db, columns, valid)
+        for i in valid:
+            for column, (_, field) in UNIQUE_COLUMNS.items():
+                if columns[column][i] in taken[column]:
+                    errors[i].append(UNIQUE_FIELDS[field][2])
+
+    rows = [i for i in range(len(chunk)) if not errors[i]]
+    for i in range(len(chunk)):
+        if errors[i]:
+            report.error(line_numbers[i], " ".join(errors[i]))
+
+    # Rows without a password get a random placeholder, to be handed to the patient or reset by staff
+    placeholders = {i: secrets.token_urlsafe(12) for i in rows if not columns["password"][i]}
+    passwords = [placeholders.get(i) or columns["password"][i] for i in rows]
+    documents = [build_documents(columns, i, password_hash) for i, password_hash in zip(rows, hash_passwords(passwords))]
+
+    try:
+        if documents:
+            db_manager.register_users([user for user, _ in documents], [patient for _, patient in documents])
+        report.inserted += len(documents)
+    except BulkWriteError:
+        # A value was taken after the lookup, e.g. by a live registration. Insert the chunk one
+        # patient at a time to find out which rows conflict.
+        for i, (user, patient) in zip(rows, documents):
+            try:
+                db_manager.register_user(user, patient)
+                report.inserted += 1
+            except DuplicateKeyError as e:
+                field = duplicate_key_field(e)
+                report.error(line_numbers[i], UNIQUE_FIELDS[field][2] if field in UNIQUE_FIELDS else "Already registered.")
+                placeholders.pop(i, None)
+
+    report.rows += len(chunk)
+    return [(columns["username"][i], password) for i, password in placeholders.items()]
+
+# Onboard every patient of a CSV stream, resuming after the rows recorded in the checkpoint file.
+# The checkpoint file is removed once the end of the stream is reached.
+# passwords_file, if given, is an open text file that gets a "username,password" row for every placeholder password.
+def onboard_patients(db_manager, stream, chunk_size, checkpoint_path, passwords_file=None):
+    state = load_checkpoint(checkpoint_path)
+    report = OnboardingReport(state["rows"], state["inserted"], state["failed"])
+
+    for chunk in read_chunks(stream, chunk_size, skip=state["rows"]):
+        placeholders = onboard_chunk(db_manager, chunk, report)
+        if passwords_file is not None:
+            csv.writer(passwords_file).writerows(placeholders)
+            passwords_file.flush()  # Before the checkpoint, so a resumed run never loses passwords
+        save_checkpoint(checkpoint_path, report)
+
+    # The whole file is done. There is no checkpoint if it had no rows left to import.
+    if os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+    return report
@@ -0,0 +1,342 @@
+# This file builds the aggregation pipelines used to search for patients.
+# The staff dashboard and advanced search use these so that a search is a single round trip to the DB.
+
+import hashlib
+import json
+import re
+from datetime import datetime, timedelta
+from bson.objectid import ObjectId
+from pagination import seek_stages
+
+# Lowercase copies of the fields searched by prefix, stored next to the originals so searches can use an index
+SHADOW_FIELDS = {"Username": "UsernameLower", "Email": "EmailLower", "NRIC": "NRICLower"}
+
+# Search modes for the identifier filters (username, email, contact number, NRIC)
+SEARCH_MODES = ("prefix", "exact", "contains")
+
+# Fill in the shadow fields of a [Users] or [Patients] document (or $set) before it is written
+def add_search_fields(doc):
+    for field, shadow in SHADOW_FIELDS.items():
+        if doc.get(field) is not None:
+            doc[shadow] = doc[field].lower()
+    return doc
+
+# Build the filter on an identifier field for the given search mode. Returns (field, condition).
+#   exact / prefix: anchored on the lowercase shadow field (or the field itself for digits only),
+#                   so the DB answers it with an index range scan
+#   contains:       unanchored case-insensitive regex, a full scan, only used when asked for
+def identifier_filter(field, value, mode):
+    value = value.strip()
+    if mode == "contains":
+        return field, {"$regex": re.escape(value), "$options": "i"}
+
+    if field in SHADOW_FIELDS:
+        field, value = SHADOW_FIELDS[field], value.lower()
+    if mode == "exact":
+        return field, value
+    return field, {"$regex": "^" + re.escape(value)}
+
+# Build the patient search pipeline used by the staff dashboard and advanced search.
+# user_query filters [Users] and patient_query filters [Patients]. The selective side is matched first:
+#   - only user fields are filtered: start from [Users] and join each matching user's patient record
+#   - otherwise: start from [Patients], so the patient filters run before any join,
+#     and the user filters are applied inside the join
+# The latest diagnosis is stored on [Patients], so [PatientHistory] never has to be joined.
+# Pages are seeked on _id of the starting collection, so the join stops once page_size + 1 patients are found.
+# Returns (collection name, pipeline, key) where key gives the cursor values of a result.
+def build_search_pipeline(user_query, patient_query, cursor=None, page_size=None, projection=None):
+    user_filters = [field for field in user_query if field != "IsStaff"]
+
+    if user_filters and not patient_query:
+        collection = "Users"
+        key = lambda patient: [patient['user']['_id']]
+        pipeline = [
+            {"$match": user_query},
+            *seek_stages(["_id"], cursor),
+            {"$lookup": {"from": "Patients", "localField": "_id", "foreignField": "UserID", "as": "patient"}},
+            # Users without a patient record are dropped here
+            {"$unwind": "$patient"},
+            # Reshape into the patient document with the user attached
+            {"$replaceRoot": {"newRoot": {"$mergeObjects": ["$patient", {"user": "$$ROOT"}]}}},
+            {"$project": {"user.patient": 0}}
+        ]
+    else:
+        collection = "Patients"
+        key = lambda patient: [patient['_id']]
+        pipeline = [
+            *([{"$match": patient_query}] if patient_query else []),
+            *seek_stages(["_id"], cursor),
+            {
+                "$lookup": {
+                    "from": "Users",
+                    "let": {"user_id": "$UserID"},
+                    "pipeline": [{"$match": {"$expr": {"$eq": ["$_id", "$$user_id"]}, **user_query}}],
+                    "as": "user"
+                }
+            },
+            # Patients whose user does not match the user filters are dropped here
+            {"$unwind": "$user"}
+        ]
+
+    if projection:
+        pipeline.append({"$project": projection})
+    if page_size:
+        pipeline.append({"$limit": page_size + 1})
+    return collection, pipeline, key
+
+# Summarise explain() output for a search pipeline: which indexes were used and how much was scanned
+# Only called in debug mode, it costs an extra round trip
+def explain_search(db, collection, pipeline):
+    explain = db.command("explain", explain_command(collection, pipeline), verbosity="executionStats")
+    return summarise_explain(explain, collection, pipeline)
+
+# The explain command for a search pipeline, also sent by the async advanced search (async_routes.py)
+def explain_command(collection, pipeline):
+    return {"aggregate": collection, "pipeline": pipeline, "cursor": {}}
+
+def summarise_explain(explain, collection, pipeline):
+    indexes = set()
+    stats = {}
+
+    def walk(node):
+        if isinstance(node, dict):
+            if "indexName" in node:
+                indexes.add(node["indexName"])
+            for field in ("nReturned", "totalKeysExamined", "totalDocsExamined"):
+                if field in node and field not in stats:
+                    stats[field] = node[field]
+            for value in node.values():
+                walk(value)
+        elif isinstance(node, list):
+            for value in node:
+                walk(value)
+
+    walk(explain)
+    return {
+        "collection": collection,
+        "stages": [next(iter(stage)) for stage in pipeline],
+        "indexes": sorted(indexes),
+        **stats
+    }
+
+# Filter on the latest diagnosis date stored on [Patients], matching anywhere within that day
+def diagnosis_date_filter(date):
+    return {"$gte": date, "$lt": date + timedelta(days=1)}
+
+# Format a date stored either as a datetime or a string to YYYY-MM-DD
+def format_date(value):
+    if isinstance(value, datetime):
+        return value.strftime('%Y-%m-%d')
+    try:
+        return datetime.strptime(str(value), '%Y-%m-%d').strftime('%Y-%m-%d')
+    except ValueError:
+        return str(value)
+
+# Fill in latest_diagnosis / diagnosis_date for display and format the DOB
+def format_dashboard_patient(patient):
+    patient['latest_diagnosis'] = patient.get('latest_diagnosis', "No diagnosis")
+    latest_date = patient.pop('latest_diagnosis_date', None)
+    patient['diagnosis_date'] = format_date(latest_date) if latest_date else "N/A"
+
+    if patient.get('PatientDOB'):
+        patient['PatientDOB'] = format_date(patient['PatientDOB'])
+
+    return patient
+
+# Short stable hash of a JSON-ready value, used for row hashes and ETags
+def row_hash(value):
+    return hashlib.md5(json.dumps(value, sort_keys=True, default=str).encode()).hexdigest()[:16]
+
+# JSON-ready copy of a formatted dashboard patient with only the fields shown in the table
+def serialise_patient(patient):
+    user = patient.get('user', {})
+    row = {
+        "_id": str(patient['_id']),
+        "PatientName": patient.get('PatientName'),
+        "NRIC": patient.get('NRIC'),
+        "PatientGender": patient.get('PatientGender'),
+        "PatientHeight": patient.get('PatientHeight'),
+        "PatientWeight": patient.get('PatientWeight'),
+        "PatientDOB": patient.get('PatientDOB'),
+        "latest_diagnosis": patient.get('latest_diagnosis'),
+        "diagnosis_date": patient.get('diagnosis_date'),
+        "user": {
+            "Username": user.get('Username'),
+            "Email": user.get('Email'),
+            "Address": user.get('Address'),
+            "ContactNumber": user.get('ContactNumber')
+        }
+    }
+    row["hash"] = row_hash(row)
+    return row
+
+# Build the [Users] and [Patients] queries from the dashboard filter parameters
+# Raises InvalidId for a bad user_id and ValueError for any other filter value that cannot be parsed
+def dashboard_filters(args):
+    # Get values from the request (GET parameters)
+    user_id = args.get('user_id', '')
+    username = args.get('username', '')
+    email = args.get('email', '')
+    address = args.get('address', '')
+    contact_number = args.get('contact_number', '')
+    name = args.get('name', '')
+    nric = args.get('nric', '')
+    gender = args.get('gender', '')
+    height = args.get('height', '')
+    weight = args.get('weight', '')
+    dob = args.get('dob', '')
+    diagnosis = args.get('diagnosis', '')
+    diagnosis_date = args.get('diagnosis_date', '')
+
+    # Identifier filters match by prefix unless "exact" or "contains" is picked
+    match_mode = args.get('match', 'prefix')
+    if match_mode not in SEARCH_MODES:
+        match_mode = 'prefix'
+
+    # Build the base query for non-staff users
+    query = {"IsStaff": 0}
+
+    # Add filters for User fields
+    if user_id:
+        query["_id"] = ObjectId(user_id)
+    if username:
+        field, condition = identifier_filter("Username", username, match_mode)
+        query[field] = condition
+    if email:
+        field, condition = identifier_filter("Email", email, match_mode)
+        query[field] = condition
+    if address:
+        query["Address"] = {"$regex": address, "$options": "i"}
+    if contact_number:
+        field, condition = identifier_filter("ContactNumber", contact_number, match_mode)
+        query[field] = condition
+
+    # Build the patient filters applied inside the join, including the latest diagnosis stored on the patient
+    patient_query = {}
+    if name:
+        patient_query["PatientName"] = {"$regex": name, "$options": "i"}
+    if nric:
+        field, condition = identifier_filter("NRIC", nric, match_mode)
+        patient_query[field] = condition
+    if gender:
+        gender_map = {'Male': 'M', 'Female': 'F'}
+        patient_query["PatientGender"] = gender_map.get(gender, gender)
+    if height:
+        patient_query["PatientHeight"] = float(height)
+    if weight:
+        patient_query["PatientWeight"] = float(weight)
+    if dob:
+        patient_query["PatientDOB"] = datetime.strptime(dob, '%Y-%m-%d')
+    if diagnosis:
+        patient_query["latest_diagnosis"] = {"$regex": diagnosis, "$options": "i"}
+    if diagnosis_date:
+        patient_query["latest_diagnosis_date"] = diagnosis_date_filter(datetime.strptime(diagnosis_date, '%Y-%m-%d'))
+
+    return query, patient_query
+
+# Build the [Users] and [Patients] conditions from the advanced search form
+# Values that cannot be parsed are ignored
+def advanced_search_filters(form):
+    # Filters are collected per collection, so the pipeline builder can match the selective side first
+    user_conditions = {'IsStaff': 0}
+    patient_conditions = {}
+
+    # Get form data for all fields
+    username = form.get('username', '')
+    email = form.get('email', '')
+    address = form.get('address', '')
+    contact_number = form.get('contact_number', '')
+    patient_name = form.get('patient_name', '')
+    nric = form.get('nric', '')
+    gender = form.get('gender', '')
+    dob = form.get('dob', '')
+    height = form.get('height', '')
+    weight = form.get('weight', '')
+    diagnosis = form.get('diagnosis', '')
+    diagnosis_date = form.get('diagnosis_date', '')
+
+    # Identifier filters match by prefix unless "exact" or "contains" is picked
+    match_mode = form.get('match', 'prefix')
+    if match_mode not in SEARCH_MODES:
+        match_mode = 'prefix'
+
+    # Add filter conditions
+    if username:
+        field, condition = identifier_filter('Username', username, match_mode)
+        user_conditions[field] = condition
+    if email:
+        field, condition = identifier_filter('Email', email, match_mode)
+        user_conditions[field] = condition
+    if address:
+        user_conditions['Address'] = {'$regex': address, '$options': 'i'}
+    if patient_name:
+        patient_conditions['PatientName'] = {'$regex': patient_name, '$options': 'i'}
+    if contact_number:
+        field, condition = identifier_filter('ContactNumber', contact_number, match_mode)
+        user_conditions[field] = condition
+    if nric:
+        field, condition = identifier_filter('NRIC', nric, match_mode)
+        patient_conditions[field] = condition
+    if gender:
+        if gender in ['Male', 'Female']:
+            gender_map = {'Male': 'M', 'Female': 'F'}
+            patient_conditions['PatientGender'] = gender_map[gender]
+    if height:
+        try:
+            patient_conditions['PatientHeight'] = float(height)
+        except ValueError:
+            pass
+    if weight:
+        try:
+            patient_conditions['PatientWeight'] = float(weight)
+        except ValueError:
+            pass
+    if dob:
+        try:
+            patient_conditions['PatientDOB'] = datetime.strptime(dob, '%Y-%m-%d')
+        except ValueError:
+            pass
+    if diagnosis:
+        patient_conditions['latest_diagnosis'] = {'$regex': diagnosis, '$options': 'i'}
+    if diagnosis_date:
+        try:
+            diag_date = datetime.strptime(diagnosis_date, '%Y-%m-%d')
+            patient_conditions['latest_diagnosis_date'] = diagnosis_date_filter(diag_date)
+        except ValueError:
+            pass
+
+    return user_conditions, patient_conditions
+
+# Only send the fields shown in the results table
+ADVANCED_SEARCH_PROJECTION = {
+    'UserID': 1, 'PatientName': 1, 'NRIC': 1, 'PatientGender': 1, 'PatientHeight': 1,
+    'PatientWeight': 1, 'PatientDOB': 1,
+    'latest_diagnosis': {'$ifNull': ['$latest_diagnosis', 'No diagnosis']},
+    'diagnosis_date': '$latest_diagnosis_date',
+    'user._id': 1, 'user.Username': 1, 'user.Email': 1, 'user.Address': 1, 'user.ContactNumber': 1
+}
+
+# Make an advanced search result JSON-ready: ObjectIds as strings and dates as YYYY-MM-DD
+def format_search_patient(patient):
+    # Convert ObjectId to string
+    patient['_id'] = str(patient['_id'])
+    patient['UserID'] = str(patient['UserID'])
+
+    # Convert user ObjectId
+    if 'user' in patient:
+        patient['user']['_id'] = str(patient['user']['_id'])
+
+    # Format dates
+    if 'PatientDOB' in patient and patient['PatientDOB']:
+        if isinstance(patient['PatientDOB'], datetime):
+            patient['PatientDOB'] = patient['PatientDOB'].strftime('%Y-%m-%d')
+
+    if 'diagnosis_date' in patient and patient['diagnosis_date']:
+        if isinstance(patient['diagnosis_date'], datetime):
+            patient['diagnosis_date'] = patient['diagnosis_date'].strftime('%Y-%m-%d')
+        else:
+            patient['diagnosis_date'] = 'N/A'
+    else:
+        patient['diagnosis_date'] = 'N/A'
+
+    return patient
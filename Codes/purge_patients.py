@@ -0,0 +1,40 @@
+# This file deletes many patients at once, e.g. to purge test accounts: python purge_patients.py --username-prefix test
+# Every patient is removed with their prescriptions, history, appointments and user account,
+# in batched transactions (see DatabaseManager.cascade_delete_patients), so no orphans are left behind.
+# Use --dry-run to only print how many patients would be deleted.
+
+import argparse
+import logging
+import re
+from db_config import DatabaseManager
+
+def main():
+    parser = argparse.ArgumentParser(description="Delete patients and everything that belongs to them.")
+    parser.add_argument('--username-prefix', required=True, help="delete the patients whose username starts with this")
+    parser.add_argument('--batch-size', type=int, default=500, help="patients deleted per transaction")
+    parser.add_argument('--dry-run', action='store_true', help="print how many patients match and exit")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    db_manager = DatabaseManager()
+    db = db_manager.get_db()
+
+    # Anchored prefix on the lowercase username, so the lookup uses its index
+    user_ids = [
+        user["_id"]
+        for user in db.Users.find(
+            {"UsernameLower": {"$regex": "^" + re.escape(args.username_prefix.lower())}, "IsStaff": {"$ne": 1}},
+            {"_id": 1}
+        )
+    ]
+    patient_filter = {"UserID": {"$in": user_ids}}
+
+    if args.dry_run:
+        print(f"{db.Patients.count_documents(patient_filter)} patients would be deleted.")
+        return
+
+    deleted = db_manager.cascade_delete_patients(patient_filter, batch_size=args.batch_size)
+    print(", ".join(f"{count} {collection}" for collection, count in deleted.items()) + " deleted.")
+
+if __name__ == '__main__':
+    main()
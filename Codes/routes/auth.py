@@ -1,12 +1,25 @@
 # This file contains the blueprint components for the authentication functions.
 # It also handles the registering of new users/patients.
 
+import logging
 from flask import render_template, request, redirect, session, url_for, flash
 from . import auth_bp
 from db import get_db_connection
 from utils import is_valid_nric, is_valid_sg_address, is_valid_sg_phone
-from werkzeug.security import generate_password_hash, check_password_hash
+from password_hashing import hash_password, verify_password, needs_rehash, rehash_in_background, HashingBusy
 from bson.objectid import ObjectId
+from patient_search import add_search_fields
+from db_config import DatabaseManager, duplicate_key_field
+from migrations import UNIQUE_ACCOUNT_INDEXES_VERSION
+from pymongo.errors import DuplicateKeyError
+from slot_availability import invalidate_availability
+
+# Form message for each field with a unique index
+DUPLICATE_MESSAGES = {
+    "Email": 'Email already registered. Please try a different email.',
+    "NRIC": 'NRIC already registered. Please try a different NRIC.',
+    "Username": 'Username already taken. Please try a different username.',
+}
 
 # User login route
 @auth_bp.route('/login', methods=['GET', 'POST'])
@@ -30,7 +43,16 @@ def login():
         db = get_db_connection()
         user = db.Users.find_one({"Username": username})
 
-        if user and check_password_hash(user['Password'], password):
+        try:
+            valid = user is not None and verify_password(user['Password'], password)
+        except HashingBusy as e:
+            flash(str(e))
+            return redirect(url_for('auth.login'))
+
+        if valid:
+            if needs_rehash(user['Password']):
+                rehash_in_background(db, user['_id'], user['Password'], password)
+
             session['user_id'] = str(user['_id'])
             session['username'] = user['Username']
             session['is_staff'] = user.get('IsStaff', 0)
@@ -56,7 +78,6 @@ def register():
         username = request.form['username']
         email = request.form['email']
         password = request.form['password']
-        hashed_password = generate_password_hash(password, method='pbkdf2:sha256')  # Hash the password
         address = request.form.get('address')
         contact_number = request.form.get('contact_number')
         name = request.form.get('name')
@@ -80,21 +101,20 @@ def register():
             flash('Invalid NRIC format. It must start with S, T, F, G, or M, followed by 7 digits and one letter.')
             return redirect(url_for('auth.register'))
 
-        db = get_db_connection()
-
-        # Check if email or nric already exists
-        user = db.Users.find_one({"Email": email})
-        existing_nric = db.Patients.find_one({"NRIC": nric})
-
-        if user:
-            flash('Email already registered. Please try a different email.')
+        # Duplicate accounts are only rejected by the unique indexes, so refuse to register without them
+        db_manager = DatabaseManager()
+        if not db_manager.has_schema_version(UNIQUE_ACCOUNT_INDEXES_VERSION):
+            logging.error("Registration refused: the unique account indexes are missing, run 'python migrate.py'")
+            flash('Registration is temporarily unavailable. Please try again later.')
             return redirect(url_for('auth.register'))
-        
-        if existing_nric:
-            flash('NRIC already registered. Please try a different NRIC.')
+
+        # Hash the password only once the form is known to be valid
+        try:
+            hashed_password = hash_password(password)
+        except HashingBusy as e:
+            flash(str(e))
             return redirect(url_for('auth.register'))
 
-        # Insert new user into the database
         user_data = {
             "Username": username,
             "Email": email,
@@ -103,20 +123,25 @@ def register():
             "ContactNumber": contact_number,
             "IsStaff": is_staff
         }
-        user_id = db.Users.insert_one(user_data).inserted_id
 
-        # Insert a corresponding record into the Patients collection with NULL values for height and weight
+        # A corresponding record in the Patients collection with NULL values for height and weight
+        patient_data = None
         if not is_staff:
-            patient_data = {
-                "UserID": user_id,
+            patient_data = add_search_fields({
                 "PatientName": name,
                 "NRIC": nric,
                 "PatientGender": gender,
                 "PatientHeight": None,
                 "PatientWeight": None,
                 "PatientDOB": dob
-            }
-            db.Patients.insert_one(patient_data)
+            })
+
+        # Insert both in one transaction, the unique indexes reject a taken email, username or NRIC
+        try:
+            db_manager.register_user(add_search_fields(user_data), patient_data)
+        except DuplicateKeyError as e:
+            flash(DUPLICATE_MESSAGES.get(duplicate_key_field(e), 'Account already registered.'))
+            return redirect(url_for('auth.register'))
 
         flash('Account created successfully! Please log in.', 'success')
         return redirect(url_for('auth.login'))
@@ -135,18 +160,14 @@ def delete_account():
     if 'user_id' not in session:
         return redirect(url_for('auth.login'))
 
-    db = get_db_connection()
     user_id = ObjectId(session['user_id'])
-    
-    # Delete all records associated with the user/patient
-    patient = db.Patients.find_one({"UserID": user_id})
-    if patient:
-        patient_id = patient['_id']
-        db.Prescriptions.delete_many({"PatientID": patient_id})
-        db.PatientHistory.delete_many({"PatientID": patient_id})
-        db.Appointments.delete_many({"PatientID": patient_id})
-        db.Patients.delete_one({"UserID": user_id})
-    db.Users.delete_one({"_id": user_id})
+
+    # Delete all records associated with the user/patient in one transaction
+    deleted = DatabaseManager().cascade_delete_patients({"UserID": user_id})
+    if not deleted["Patients"]:
+        # Account without a patient record
+        get_db_connection().Users.delete_one({"_id": user_id})
+    invalidate_availability()
 
     # Clear session and log the user out after deleting account
     session.clear()
@@ -1,12 +1,24 @@
 # This file contains the blueprint components for medications.
 # It includes the function to manage medications.
 
+import io
+import logging
 from flask import render_template, request, redirect, session, url_for, flash, jsonify
 from . import medication_bp
 from db import get_db_connection
 from datetime import datetime
 from bson.objectid import ObjectId, InvalidId
+from pymongo.errors import PyMongoError
 from db_config import DatabaseManager
+from medication_index import medication_index, typeahead_cache, search_medications as lookup_medications
+from config import Config
+from pagination import decode_cursor, seek_stages, build_page
+from cache import TTLCache
+from sequences import med_ids
+from medication_import import import_medications, format_from_filename, ImportReport
+
+# Cached medication counts for searches, keyed on the search text
+medication_count_cache = TTLCache(maxsize=256, ttl=Config.MEDICATION_COUNT_TTL)
 
 def is_valid_objectid(oid):
     try:
@@ -26,9 +38,15 @@ def medications():
 
     search_query = request.args.get('search')
 
-    # Get the current page (default to 1) and set number of medications per page for table
+    # Page number is only used for display, the rows are located with the cursor
     page = request.args.get('page', 1, type=int)
     per_page = 100  # Limit the number of items displayed per page for table
+
+    try:
+        cursor = decode_cursor(request.args.get('cursor'))
+    except ValueError as e:
+        flash(str(e), 'danger')
+        return redirect(url_for('medication.medications'))
     
     # Build the query for medications
     if search_query:
@@ -36,21 +54,37 @@ def medications():
     else:
         query = {}
 
-    total_medications = medications_collection.count_documents(query)
+    total_medications = count_medications(medications_collection, query, search_query)
 
     # Calculate total number of pages for pagination
     total_pages = (total_medications // per_page) + (1 if total_medications % per_page > 0 else 0)
 
     # Ensure the page number is within valid bounds
-    if page < 1:
+    if page < 1 or cursor is None:
         page = 1
     elif page > total_pages and total_pages > 0:
         page = total_pages
 
-    # Fetch the medications for the current page, limited by per_page (pagination applied here)
-    medications = list(medications_collection.find(query).sort("name", 1).skip((page - 1) * per_page).limit(per_page))
+    # Fetch the medications for the current page by seeking on the (name, _id) index instead of skipping
+    pipeline = [{"$match": query}] + seek_stages(["name", "_id"], cursor) + [{"$limit": per_page + 1}]
+    medications, next_cursor, prev_cursor = build_page(
+        list(medications_collection.aggregate(pipeline)), cursor, per_page, key=lambda m: [m['name'], m['_id']]
+    )
+
+    return render_template('medications.html', medications=medications, page=page, total_pages=total_pages,
+                           search=search_query, next_cursor=next_cursor, prev_cursor=prev_cursor)
+
+# Total number of medications for the pagination display
+# Without a search this is the collection metadata count; search counts are cached for a short time
+def count_medications(medications_collection, query, search_query):
+    if not search_query:
+        return medications_collection.estimated_document_count()
 
-    return render_template('medications.html', medications=medications, page=page, total_pages=total_pages, search=search_query)
+    total = medication_count_cache.get(search_query)
+    if total is None:
+        total = medications_collection.count_documents(query)
+        medication_count_cache.set(search_query, total)
+    return total
 
 @medication_bp.route('/search_medications')
 def search_medications():
@@ -59,18 +93,18 @@ def search_medications():
     if not query:
         return jsonify([])  # Return empty if no query is provided
 
-    db = get_db_connection()
-    medications_collection = db['Medications']
+    # Look the prefix up in the typeahead cache / in-memory autocomplete index, this never queries the DB
+    results = lookup_medications(query, limit=20)
 
-    # Perform a case-insensitive search using regex and limit to 8 results
-    medications = list(medications_collection.find({
-        "name": {"$regex": query, "$options": "i"}
-    }).limit(20))  # Adjust limit as necessary
+    return jsonify(results)
 
-    # Only return the name field for each medication
-    results = [{"name": medication['name']} for medication in medications]
+# Typeahead cache statistics, to check how much search load is kept off the DB
+@medication_bp.route('/search_medications/stats')
+def search_medications_stats():
+    if not session.get('is_staff') == 1:
+        return jsonify({'error': 'Unauthorized'}), 403
 
-    return jsonify(results)
+    return jsonify(typeahead_cache.stats())
 
 # Medication quantity updates route
 @medication_bp.route('/update_medication_quantity', methods=['POST'])
@@ -119,6 +153,8 @@ def update_medication_quantity():
             "date": datetime.now()
         })
         
+        medication_index.adjust_quantity(medication['_id'], quantity_change)
+
         new_quantity = medication['quantity'] + quantity_change
         flash(f'Medication "{medication["name"]}" updated. New quantity: {new_quantity}', 'success')
     else:
@@ -153,13 +189,11 @@ def manage_medication():
     db = get_db_connection()
     medications_collection = db['Medications']
 
-    # Fetch the last medication to determine the highest MedID
-    last_medication = list(medications_collection.find().sort("MedID", -1).limit(1))
-    last_med_id = last_medication[0]["MedID"] if len(last_medication) > 0 else 0
-    new_med_id = last_med_id + 1
+    # Take the next MedID from its counter, unique even when medications are added concurrently
+    new_med_id = med_ids.next_id()
 
     # Insert new medication into the Medications collection
-    medications_collection.insert_one({
+    result = medications_collection.insert_one({
         "MedID": new_med_id,
         "name": name,
         "form": form,
@@ -168,10 +202,55 @@ def manage_medication():
         "indication": indication
     })
 
+    medication_count_cache.clear()
+    medication_index.add(result.inserted_id, name, quantity)
+
     flash(f'Medication "{name}" added successfully with MedID {new_med_id}.', 'success')
 
     return redirect(url_for('medication.medications'))
 
+# Import route, adds or updates the medications of an uploaded CSV or JSON Lines file (see medication_import.py)
+@medication_bp.route('/import_medications', methods=['POST'])
+def import_medications_route():
+    if not session.get('is_staff') == 1:
+        flash("You do not have permission to import medications.")
+        return redirect(url_for('patient.patient_dashboard'))
+
+    upload = request.files.get('file')
+    if not upload or not upload.filename:
+        flash('Please choose a file to import.', 'danger')
+        return redirect(url_for('medication.medications'))
+
+    file_format = format_from_filename(upload.filename)
+    if file_format is None:
+        flash('Only .csv and .jsonl (JSON Lines) files can be imported.', 'danger')
+        return redirect(url_for('medication.medications'))
+
+    # Read the upload as text line by line instead of loading it into memory
+    stream = io.TextIOWrapper(upload.stream, encoding='utf-8-sig', newline='')
+    report = ImportReport()
+    try:
+        import_medications(get_db_connection(), stream, file_format, Config.IMPORT_BATCH_SIZE, report)
+        flash(f'Import finished: {report.summary()}', 'success' if not report.failed else 'warning')
+    except (UnicodeDecodeError, PyMongoError) as e:
+        # The batches written before the failure stay imported, so report what was done
+        if isinstance(e, UnicodeDecodeError):
+            reason = 'the rest of the file is not UTF-8 encoded'
+        else:
+            logging.error(f"Medication import failed: {str(e)}")
+            reason = 'a database error occurred, please try again'
+        flash(f'Import stopped, {reason}. Imported before stopping: {report.summary()}', 'danger')
+    finally:
+        medication_count_cache.clear()
+        medication_index.start()  # Rebuild the autocomplete index in the background
+
+    for line_number, message in report.errors[:5]:
+        flash(f'Line {line_number}: {message}', 'danger')
+    if report.failed > 5:
+        flash(f'... and {report.failed - 5} more rows were skipped.', 'danger')
+
+    return redirect(url_for('medication.medications'))
+
 # Deleting med route
 @medication_bp.route('/delete_medication', methods=['POST'])
 def delete_medication():
@@ -201,6 +280,8 @@ def delete_medication():
 
     # Delete the medication from the collection
     medications_collection.delete_one({"_id": ObjectId(medication_id)})
+    medication_count_cache.clear()
+    medication_index.remove(medication["_id"], medication["name"])
 
     flash(f'Medication "{medication["name"]}" deleted successfully.', 'success')
 
@@ -1,13 +1,16 @@
 # This file contains the blueprint components for the staff role.
 
-from flask import render_template, request, redirect, session, url_for, flash
+from flask import render_template, request, redirect, session, url_for, flash, jsonify
 from . import patient_bp
 from db import get_db_connection
 from utils import is_valid_sg_address, is_valid_sg_phone
-from werkzeug.security import generate_password_hash
+from password_hashing import hash_password, HashingBusy
 from datetime import datetime, timedelta
 from bson.objectid import ObjectId
 from db_config import DatabaseManager
+from patient_search import add_search_fields
+from slot_availability import get_availability, invalidate_availability
+from uniqueness import find_conflicts
 
 # Patient Dashboard route
 @patient_bp.route('/patient_dashboard')
@@ -60,30 +63,37 @@ def update_account():
             flash('Invalid Singapore phone number. Please provide a valid 8-digit number starting with 6, 8, or 9.')
             return redirect(url_for('patient.update_account'))
 
-        # Check if email already exists for another user
-        existing_user = db.Users.find_one({"Email": email, "_id": {"$ne": ObjectId(session['user_id'])}})
+        # Check the email and username are not used by another account, both looked up at the same time
+        conflicts = find_conflicts(db, {"Email": email, "Username": username}, exclude={"Users": ObjectId(session['user_id'])})
 
-        if existing_user:
+        if 'email' in conflicts:
             flash('Email is already in use by another account.')
             return redirect(url_for('patient.update_account'))
+        if 'username' in conflicts:
+            flash('Username is already in use by another account.')
+            return redirect(url_for('patient.update_account'))
 
         # Fetch current user to get existing password
-        user = db.Users.find_one({"_id": ObjectId(session['user_id'])})
+        user = db.Users.find_one({"_id": ObjectId(session['user_id'])}, {"Password": 1})
         existing_hashed_password = user['Password']
 
         # Check if there is new password, if not keep the old one
-        hashed_password = generate_password_hash(password, method='pbkdf2:sha256') if password.strip() else existing_hashed_password
+        try:
+            hashed_password = hash_password(password) if password.strip() else existing_hashed_password
+        except HashingBusy as e:
+            flash(str(e))
+            return redirect(url_for('patient.update_account'))
 
         # Update new details into the DB
         db.Users.update_one(
             {"_id": ObjectId(session['user_id'])},
-            {"$set": {
+            {"$set": add_search_fields({
                 "Username": username,
                 "Email": email,
                 "Password": hashed_password,
                 "Address": address,
                 "ContactNumber": contact_number
-            }}
+            })}
         )
 
         # Update session data with new username
@@ -173,7 +183,10 @@ def book_appointment():
             }
 
             # Use atomic booking operation
-            if db_manager.atomic_book_appointment(appointment_data):
+            # The cached availability is stale either way: the slot is now booked, or it was already taken
+            booked = db_manager.atomic_book_appointment(appointment_data)
+            invalidate_availability()
+            if booked:
                 flash('Appointment booked successfully!', 'success')
                 return redirect(url_for('patient.patient_dashboard'))
             else:
@@ -186,3 +199,11 @@ def book_appointment():
 
     # For GET request, render the booking form
     return render_template('book_appointment.html', min_date=today, max_date=one_week_later)
+
+# Free/booked map of every slot in the booking window, used by the booking forms of patients and staff
+@patient_bp.route('/appointment_availability')
+def appointment_availability():
+    if 'user_id' not in session:
+        return jsonify({'error': 'Unauthorized'}), 403
+
+    return jsonify(get_availability(get_db_connection()))
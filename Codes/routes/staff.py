@@ -1,15 +1,40 @@
 # This file contains the blueprint components for the staff role.
 
-from flask import render_template, request, redirect, session, url_for, flash, jsonify
+from flask import render_template, request, redirect, session, url_for, flash, jsonify, current_app
 from . import staff_bp
 from db import get_db_connection
 from utils import is_valid_nric, is_valid_sg_address, is_valid_sg_phone
-from werkzeug.security import generate_password_hash
+from password_hashing import hash_password, HashingBusy
 from datetime import datetime, timedelta
-from bson.objectid import ObjectId
-from bson import json_util
+from bson.objectid import ObjectId, InvalidId
+from pymongo.errors import DuplicateKeyError
 import logging
 from db_config import DatabaseManager
+from medication_index import medication_index, search_medications as lookup_medications
+from patient_search import build_search_pipeline, explain_search, format_dashboard_patient, format_date
+from patient_search import add_search_fields, serialise_patient, row_hash, dashboard_filters
+from patient_search import advanced_search_filters, format_search_patient, ADVANCED_SEARCH_PROJECTION
+from patient_history import record_latest_diagnosis, refresh_latest_diagnosis, save_diagnoses
+from patient_history import past_prescriptions_pipeline, format_record_dates
+from pagination import decode_cursor, build_page
+from text_search import search_records, SOURCES
+from slot_availability import invalidate_availability
+from appointment_batch import complete_appointments, delete_appointments, reschedule_appointments
+from uniqueness import find_conflicts, run_concurrently
+from cache import TTLCache
+from config import Config
+from .medication import is_valid_objectid
+
+# Short-lived cache of dashboard result pages, keyed on the filter values and cursor
+dashboard_cache = TTLCache(maxsize=Config.DASHBOARD_CACHE_SIZE, ttl=Config.DASHBOARD_CACHE_TTL)
+
+# Fetch one page of users and their patient records in a single aggregation
+# Returns (patients, next cursor, prev cursor)
+def fetch_dashboard_page(db, user_query, patient_query, cursor):
+    page_size = current_app.config['PAGE_SIZE']
+    collection, pipeline, key = build_search_pipeline(user_query, patient_query, cursor, page_size)
+    patients, next_cursor, prev_cursor = build_page(list(db[collection].aggregate(pipeline)), cursor, page_size, key)
+    return [format_dashboard_patient(patient) for patient in patients], next_cursor, prev_cursor
 
 # Staff Dashboard route
 @staff_bp.route('/staff_dashboard', methods=['GET'])
@@ -17,134 +42,88 @@ def staff_dashboard():
     if 'is_staff' in session and session['is_staff'] == 1:
         db = get_db_connection()
 
-        # Get values from the request (GET parameters)
-        user_id = request.args.get('user_id', '')
-        username = request.args.get('username', '')
-        email = request.args.get('email', '')
-        address = request.args.get('address', '')
-        contact_number = request.args.get('contact_number', '')
-        name = request.args.get('name', '')
-        nric = request.args.get('nric', '')
-        gender = request.args.get('gender', '')
-        height = request.args.get('height', '')
-        weight = request.args.get('weight', '')
-        dob = request.args.get('dob', '')
-        diagnosis = request.args.get('diagnosis', '')
-        diagnosis_date = request.args.get('diagnosis_date', '')
-
-        # Build the base query for non-staff users
-        query = {"IsStaff": 0}
-
-        # Add filters for User fields
-        if user_id:
-            try:
-                query["_id"] = ObjectId(user_id)
-            except Exception:
-                flash("Invalid User ID format.")
-                return redirect(url_for('staff.staff_dashboard'))
-        if username:
-            query["Username"] = {"$regex": username, "$options": "i"}
-        if email:
-            query["Email"] = {"$regex": email, "$options": "i"}
-        if address:
-            query["Address"] = {"$regex": address, "$options": "i"}
-        if contact_number:
-            query["ContactNumber"] = {"$regex": contact_number, "$options": "i"}
-
-        # Fetch users who are not staff and match the criteria
-        user_matches = list(db.Users.find(query))
-        
-        # Prepare list to store patient data with latest diagnoses
-        patients = []
-
-        for user in user_matches:
-            # Find corresponding patient record
-            patient_query = {"UserID": user["_id"]}
-
-            # Add patient-specific filters
-            if name:
-                patient_query["PatientName"] = {"$regex": name, "$options": "i"}
-            if nric:
-                patient_query["NRIC"] = {"$regex": nric, "$options": "i"}
-            if gender:
-                gender_map = {'Male': 'M', 'Female': 'F'}
-                patient_query["PatientGender"] = gender_map.get(gender, gender)
-            if height:
-                try:
-                    patient_query["PatientHeight"] = float(height)
-                except ValueError:
-                    continue
-            if weight:
-                try:
-                    patient_query["PatientWeight"] = float(weight)
-                except ValueError:
-                    continue
-            if dob:
-                try:
-                    patient_query["PatientDOB"] = datetime.strptime(dob, '%Y-%m-%d')
-                except ValueError:
-                    continue
+        try:
+            query, patient_query = dashboard_filters(request.args)
+        except InvalidId:
+            flash("Invalid User ID format.")
+            return redirect(url_for('staff.staff_dashboard'))
+        except ValueError:
+            # An unparseable filter value cannot match any patient
+            return render_template('staff_dashboard.html', patients=[])
 
-            patient = db.Patients.find_one(patient_query)
-            
-            if patient:
-                # Attach user information to patient details
-                patient['user'] = user
-
-                # Fetch latest diagnosis
-                diagnosis_query = {"patient_id": patient["_id"]}
-                if diagnosis:
-                    diagnosis_query["diagnosis"] = {"$regex": diagnosis, "$options": "i"}
-                if diagnosis_date:
-                    try:
-                        date_obj = datetime.strptime(diagnosis_date, '%Y-%m-%d')
-                        diagnosis_query["date"] = date_obj
-                    except ValueError:
-                        continue
-
-                # Get the latest diagnosis
-                latest_diagnosis = db.PatientHistory.find_one(
-                    diagnosis_query,
-                    sort=[("date", -1)]
-                )
-
-                if latest_diagnosis:
-                    patient['latest_diagnosis'] = latest_diagnosis.get("diagnosis", "")
-                    # Format the date if it exists
-                    if 'date' in latest_diagnosis and latest_diagnosis['date']:
-                        if isinstance(latest_diagnosis['date'], datetime):
-                            patient['diagnosis_date'] = latest_diagnosis['date'].strftime('%Y-%m-%d')
-                        else:
-                            # Handle string dates
-                            try:
-                                date_obj = datetime.strptime(str(latest_diagnosis['date']), '%Y-%m-%d')
-                                patient['diagnosis_date'] = date_obj.strftime('%Y-%m-%d')
-                            except ValueError:
-                                patient['diagnosis_date'] = str(latest_diagnosis['date'])
-                else:
-                    patient['latest_diagnosis'] = "No diagnosis"
-                    patient['diagnosis_date'] = "N/A"
-
-                patients.append(patient)
-
-        # Format patient dates before passing to template
-        for patient in patients:
-            if 'PatientDOB' in patient and patient['PatientDOB']:
-                if isinstance(patient['PatientDOB'], datetime):
-                    patient['PatientDOB'] = patient['PatientDOB'].strftime('%Y-%m-%d')
-                elif isinstance(patient['PatientDOB'], str):
-                    # If it's already a string, try to parse and reformat it
-                    try:
-                        date_obj = datetime.strptime(patient['PatientDOB'], '%Y-%m-%d')
-                        patient['PatientDOB'] = date_obj.strftime('%Y-%m-%d')
-                    except ValueError:
-                        pass
-
-        return render_template('staff_dashboard.html', patients=patients)
+        try:
+            cursor = decode_cursor(request.args.get('cursor'))
+        except ValueError as e:
+            flash(str(e))
+            return redirect(url_for('staff.staff_dashboard'))
+
+        patients, next_cursor, prev_cursor = fetch_dashboard_page(db, query, patient_query, cursor)
+
+        # Keep the current filters on the next/prev links
+        filters = request.args.to_dict()
+        filters.pop('cursor', None)
+        next_url = url_for('staff.staff_dashboard', **filters, cursor=next_cursor) if next_cursor else None
+        prev_url = url_for('staff.staff_dashboard', **filters, cursor=prev_cursor) if prev_cursor else None
+
+        return render_template('staff_dashboard.html', patients=patients, next_url=next_url, prev_url=prev_url)
     else:
         flash('Please login or create a new account to access our services.')
         return redirect(url_for('auth.login'))
-        
+
+# Live filtering for the staff dashboard, called by the page as staff type into the filters
+# Pages are cached for a few seconds per filter combination and carry an ETag, so repeated
+# requests are answered with 304. Only rows the page does not already show (per the "have"
+# parameter of id:hash pairs) are sent in full; "order" lists every row id of the page.
+@staff_bp.route('/staff_dashboard/filter', methods=['GET'])
+def staff_dashboard_filter():
+    if 'is_staff' not in session or session['is_staff'] != 1:
+        return jsonify({'error': 'Unauthorized'}), 403
+
+    filters = request.args.to_dict()
+    have = filters.pop('have', '')
+    cache_key = tuple(sorted(filters.items()))
+
+    page = dashboard_cache.get(cache_key)
+    if page is None:
+        generation = dashboard_cache.generation
+        try:
+            cursor = decode_cursor(filters.get('cursor'))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
+        try:
+            query, patient_query = dashboard_filters(filters)
+        except InvalidId:
+            return jsonify({'error': 'Invalid User ID format.'}), 400
+        except ValueError:
+            # An unparseable filter value cannot match any patient
+            patients, next_cursor, prev_cursor = [], None, None
+        else:
+            patients, next_cursor, prev_cursor = fetch_dashboard_page(get_db_connection(), query, patient_query, cursor)
+
+        rows = [serialise_patient(patient) for patient in patients]
+        page = {
+            "rows": rows,
+            "next": next_cursor,
+            "prev": prev_cursor,
+            "etag": row_hash({"rows": [row["hash"] for row in rows], "next": next_cursor, "prev": prev_cursor})
+        }
+        dashboard_cache.set(cache_key, page, generation)
+
+    if request.if_none_match.contains(page["etag"]):
+        response = current_app.response_class(status=304)
+    else:
+        known = dict(pair.split(':', 1) for pair in have.split(',') if ':' in pair)
+        response = jsonify({
+            "order": [row["_id"] for row in page["rows"]],
+            "rows": [row for row in page["rows"] if known.get(row["_id"]) != row["hash"]],
+            "next": page["next"],
+            "prev": page["prev"]
+        })
+    response.set_etag(page["etag"])
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
 # Edit patient records route
 @staff_bp.route('/edit_patient/<string:patient_id>', methods=['GET', 'POST'])
 def edit_patient(patient_id):
@@ -155,17 +134,25 @@ def edit_patient(patient_id):
     db = get_db_connection()
     errors = {}
 
-    # Fetch patient details
-    patient = db.Patients.find_one({"_id": ObjectId(patient_id)})
-    if not patient:
+    # Fetch the patient with their user (joined on UserID) and the patient's diagnoses at the same time
+    # The diagnoses are also used to skip the unchanged rows when the form is saved
+    found, patient_diagnoses = run_concurrently(
+        lambda: list(db.Patients.aggregate([
+            {"$match": {"_id": ObjectId(patient_id)}},
+            {"$lookup": {"from": "Users", "localField": "UserID", "foreignField": "_id", "as": "user"}}
+        ])),
+        lambda: list(db.PatientHistory.find({"patient_id": ObjectId(patient_id)}).sort("date", -1))
+    )
+    if not found:
         flash('Patient not found.', 'danger')
         return redirect(url_for('staff.staff_dashboard'))
+    patient = found[0]
 
-    # Fetch the corresponding user using UserID
-    user = db.Users.find_one({"_id": ObjectId(patient['UserID'])})
-    if not user:
+    users = patient.pop('user')
+    if not users:
         flash('User not found for the given patient.', 'danger')
         return redirect(url_for('staff.staff_dashboard'))
+    user = users[0]
     
     # If PatientDOB exists, format it to YYYY-MM-DD
     if patient.get('PatientDOB'):
@@ -190,11 +177,11 @@ def edit_patient(patient_id):
         address = request.form['address']
         password = request.form.get('password')
 
-        # Handle past diagnosis update or add
+        # Handle past diagnosis updates, one row per [PatientHistory] record shown on the page
         diagnosis_text = []
         diagnosis_date = []
         diagnosis_notes = []
-        appt_id = []
+        history_id = []
 
         # Collect the diagnosis form data using dynamic field names
         idx = 1
@@ -202,9 +189,24 @@ def edit_patient(patient_id):
             diagnosis_text.append(request.form[f"diagnosis_text_{idx}"])
             diagnosis_date.append(request.form[f"diagnosis_date_{idx}"])
             diagnosis_notes.append(request.form[f"diagnosis_notes_{idx}"])
-            appt_id.append(request.form[f"appt_id_{idx}"])
+            history_id.append(request.form.get(f"history_id_{idx}", ''))
             idx += 1
 
+        # Parse the diagnosis rows before anything is written
+        diagnosis_rows = []
+        for idx, record_id in enumerate(history_id):
+            if not is_valid_objectid(record_id):
+                logging.error(f"Invalid history_id: {record_id}")
+                flash(f"Invalid diagnosis record ID: {record_id}", 'danger')
+                return redirect(url_for('staff.staff_dashboard'))
+
+            diagnosis_rows.append({
+                "history_id": ObjectId(record_id),
+                "diagnosis": diagnosis_text[idx],
+                "date": datetime.strptime(diagnosis_date[idx], '%Y-%m-%d'),
+                "notes": diagnosis_notes[idx]
+            })
+
         # Validations
         if not is_valid_nric(nric):
             errors['nric'] = 'Invalid NRIC format. It must start with S, T, F, G, or M, followed by 7 digits and one letter.'
@@ -215,34 +217,24 @@ def edit_patient(patient_id):
         if not is_valid_sg_address(address):
             errors['address'] = 'Invalid address. Please include a valid 6-digit postal code.'
 
-        # Check for existing user with the same email, contact number, or username
-        existing_user = db.Users.find_one({
-            "$or": [
-                {"Email": email},
-                {"ContactNumber": contact_number},
-                {"Username": username}
-            ],
-            "_id": {"$ne": ObjectId(patient['UserID'])}  # Use patient's UserID to properly exclude
-        })
-
-        existing_nric = db.Patients.find_one({
-            "NRIC": nric,
-            "_id": {"$ne": ObjectId(patient_id)}
-        })
-
-        if existing_user:
-            if existing_user['Email'] == email:
-                errors['email'] = 'Email is already in use.'
-            if existing_user['ContactNumber'] == contact_number:
-                errors['contact_number'] = 'Contact number is already in use.'
-            if existing_user['Username'] == username:
-                errors['username'] = 'Username is already in use.'
-
-        if existing_nric:
-            errors['nric'] = 'NRIC is already in use.'
+        # Check for another user with the same email, contact number or username, or another patient with the NRIC
+        errors.update(find_conflicts(
+            db,
+            {"Email": email, "ContactNumber": contact_number, "Username": username, "NRIC": nric},
+            exclude={"Users": ObjectId(patient['UserID']), "Patients": ObjectId(patient_id)}
+        ))
 
         # If no errors, update the patient details in the DB
         if not errors:
+            # Hash a new password first, so nothing is written if the hashing pool is busy
+            hashed_password = None
+            if password and password.strip():
+                try:
+                    hashed_password = hash_password(password)
+                except HashingBusy as e:
+                    flash(str(e), 'danger')
+                    return redirect(url_for('staff.edit_patient', patient_id=patient_id))
+
             patient_update = {
                 "PatientName": patient_name,
                 "NRIC": nric,
@@ -251,7 +243,7 @@ def edit_patient(patient_id):
                 "PatientWeight": float(patient_weight) if patient_weight.strip() else None,
                 "PatientDOB": datetime.strptime(patient_dob, '%Y-%m-%d')
             }
-            db.Patients.update_one({"_id": ObjectId(patient_id)}, {"$set": patient_update})
+            db.Patients.update_one({"_id": ObjectId(patient_id)}, {"$set": add_search_fields(patient_update)})
 
             user_update = {
                 "Username": username,
@@ -259,50 +251,19 @@ def edit_patient(patient_id):
                 "ContactNumber": contact_number,
                 "Address": address
             }
-            if password and password.strip():
-                user_update["Password"] = generate_password_hash(password, method='pbkdf2:sha256')
-            db.Users.update_one({"_id": ObjectId(patient['UserID'])}, {"$set": user_update})
+            if hashed_password:
+                user_update["Password"] = hashed_password
+            db.Users.update_one({"_id": ObjectId(patient['UserID'])}, {"$set": add_search_fields(user_update)})
 
-           # Handle diagnosis updates and inserts
-            for idx, appt in enumerate(appt_id):
-                # Convert appt_id to ObjectId if it's a valid string
-                try:
-                    appt_object_id = ObjectId(appt)  # This will raise an error if appt is not a valid ObjectId string
-                except Exception as e:
-                    logging.error(f"Invalid appt_id: {appt}, Error: {str(e)}")
-                    flash(f"Invalid appointment ID: {appt}", 'danger')
-                    return redirect(url_for('staff.staff_dashboard'))
-
-                diagnosis_data = {
-                    "diagnosis": diagnosis_text[idx],
-                    "date": datetime.strptime(diagnosis_date[idx], '%Y-%m-%d'),
-                    "notes": diagnosis_notes[idx],
-                    "appt_id": appt_object_id  # Store as ObjectId
-                }
-
-                # Check if diagnosis already exists in PatientHistory for the given patient and appt_id
-                existing_diagnosis = db.PatientHistory.find_one({
-                    "patient_id": ObjectId(patient_id),  # Make sure patient_id is ObjectId
-                    "appt_id": appt_object_id  # Compare with ObjectId in the query
-                })
-
-                if existing_diagnosis:
-                    # If the diagnosis already exists, update it
-                    db.PatientHistory.update_one(
-                        {"_id": existing_diagnosis["_id"]},
-                        {"$set": diagnosis_data}
-                    )
-                else:
-                    # If the diagnosis doesn't exist, insert a new record
-                    diagnosis_data["patient_id"] = ObjectId(patient_id)  # Ensure patient_id is an ObjectId
-                    db.PatientHistory.insert_one(diagnosis_data)
+            # Save the edited diagnoses in one round trip, rows that did not change are skipped
+            if save_diagnoses(db, ObjectId(patient_id), diagnosis_rows, patient_diagnoses):
+                # Edited dates can change which diagnosis is the latest, so recompute it from the history
+                refresh_latest_diagnosis(db, ObjectId(patient_id))
 
+            dashboard_cache.bump()
             flash('Patient details and diagnoses updated successfully!', 'success')
             return redirect(url_for('staff.staff_dashboard'))
 
-    # Fetch patient diagnoses
-    patient_diagnoses = list(db.PatientHistory.find({"patient_id": ObjectId(patient_id)}).sort("date", -1))
-
     # Format diagnosis date
     for diag in patient_diagnoses:
         if diag.get('date'):
@@ -318,16 +279,12 @@ def delete_patient(patient_id):
         flash('You do not have access to this page.')
         return redirect(url_for('auth.login'))
 
-    db = get_db_connection()
-
     try:
-        # Delete from all collections associated with patients
-        db.Prescriptions.delete_many({"patient_id": ObjectId(patient_id)})
-        db.PatientHistory.delete_many({"patient_id": ObjectId(patient_id)})
-        db.Appointments.delete_many({"patient_id": ObjectId(patient_id)})
-        db.Patients.delete_one({"_id": ObjectId(patient_id)})
-        db.Users.delete_one({"_id": ObjectId(patient_id)})
+        # Delete the patient, their records and their user account in one transaction
+        DatabaseManager().cascade_delete_patients({"_id": ObjectId(patient_id)})
 
+        dashboard_cache.bump()
+        invalidate_availability()
         flash('Patient and associated appointments deleted successfully!', 'success')
     except Exception as err:
         flash(f'An error occurred: {err}', 'danger')
@@ -385,46 +342,37 @@ def view_patient(patient_id, appt_id):
 
     # Check if POST for adding medication or diagnosis
     if request.method == 'POST':
-        if 'medication' in request.form:
-            # Handle medication prescription
-            medication_name = request.form['medication']
-            med_name_only = medication_name.split(' (')[0]
-            duration = request.form['duration']
-            notes = request.form['notes']
-
-            med = db.Medications.find_one({"name": med_name_only})
-
-            if med:
-                med_id = med['_id']
-                current_quantity = med['quantity']
-                requested_dosage = int(duration)
-
-                if current_quantity >= requested_dosage:
-                    # Insert prescription
-                    db.Prescriptions.insert_one({
-                        "patient_id": patient_object_id,
-                        "appt_id": ObjectId(appt_id),
-                        "med_id": med_id,
-                        "dosage": requested_dosage,
-                        "date": datetime.now(),
-                        "notes": notes
-                    })
-                    # Update quantity
-                    db.Medications.update_one({"_id": med_id}, {"$inc": {"quantity": -requested_dosage}})
-
-                    # Insert inventory log
-                    db.InventoryLogs.insert_one({
-                        "med_id": med_id,
-                        "change_type": 'subtract',
-                        "quantity_changed": requested_dosage,
-                        "date": datetime.now()
-                    })
+        # Both are recorded against the visit
+        if not is_valid_objectid(appt_id):
+            flash('Invalid appointment ID format.', 'danger')
+            return redirect(url_for('staff.staff_dashboard'))
 
+        if 'medication' in request.form:
+            # Handle medication prescription, the form can hold several medications for this visit
+            items = []
+            for medication_name, duration, notes in zip(request.form.getlist('medication'),
+                                                        request.form.getlist('duration'),
+                                                        request.form.getlist('notes')):
+                try:
+                    requested_dosage = int(duration)
+                except ValueError:
+                    requested_dosage = 0
+                if requested_dosage < 1:
+                    items = None
+                    break
+                items.append({"name": medication_name.split(' (')[0], "dosage": requested_dosage, "notes": notes})
+
+            if not items:
+                flash('Quantity must be a positive number.', 'danger')
+            else:
+                # Stock check, stock update, prescriptions and inventory logs all happen in one transaction
+                success, error = DatabaseManager().atomic_prescribe(patient_object_id, ObjectId(appt_id), items)
+                if success:
+                    for item in items:
+                        medication_index.adjust_quantity(item['med_id'], -item['dosage'])
                     flash('Prescription added successfully!', 'success')
                 else:
-                    flash('Not enough medication in stock!', 'danger')
-            else:
-                flash('Medication not found!', 'danger')
+                    flash(error, 'danger')
         else:
             # Handle patient history addition
             diagnosis = request.form['diagnosis']
@@ -438,6 +386,8 @@ def view_patient(patient_id, appt_id):
                 "notes": notes,
                 "date": date
             })
+            record_latest_diagnosis(db, patient_object_id, diagnosis, date)
+            dashboard_cache.bump()
 
             flash('Patient history updated successfully!', 'success')
 
@@ -448,52 +398,10 @@ def view_patient(patient_id, appt_id):
         return redirect(url_for('staff.staff_dashboard'))
 
     # Fetch patient history
-    patient_history = list(db.PatientHistory.find({"patient_id": patient_object_id}))
-
-    # Format dates in patient history
-    for record in patient_history:
-        if 'date' in record:
-            if isinstance(record['date'], datetime):
-                record['date'] = record['date'].strftime('%Y-%m-%d')
-            elif isinstance(record['date'], str):
-                try:
-                    # Try to parse the string date and format it
-                    date_obj = datetime.strptime(record['date'], '%Y-%m-%d')
-                    record['date'] = date_obj.strftime('%Y-%m-%d')
-                except ValueError:
-                    record['date'] = record['date']  # Keep original string if parsing fails
+    patient_history = format_record_dates(list(db.PatientHistory.find({"patient_id": patient_object_id})))
 
     # Fetch past prescriptions
-    past_prescriptions = list(db.Prescriptions.aggregate([
-        {"$match": {"patient_id": patient_object_id}},
-        {"$lookup": {
-            "from": "Medications",
-            "localField": "med_id",
-            "foreignField": "_id",
-            "as": "medication_details"
-        }},
-        {"$unwind": "$medication_details"},
-        {"$project": {
-            "prescription_id": "$_id",
-            "medication_name": "$medication_details.name",
-            "dosage": 1,
-            "date": 1,
-            "notes": 1
-        }}
-    ]))
-
-    # Format dates in prescriptions
-    for prescription in past_prescriptions:
-        if 'date' in prescription:
-            if isinstance(prescription['date'], datetime):
-                prescription['date'] = prescription['date'].strftime('%Y-%m-%d')
-            elif isinstance(prescription['date'], str):
-                try:
-                    # Try to parse the string date and format it
-                    date_obj = datetime.strptime(prescription['date'], '%Y-%m-%d')
-                    prescription['date'] = date_obj.strftime('%Y-%m-%d')
-                except ValueError:
-                    prescription['date'] = prescription['date']  # Keep original string if parsing fails
+    past_prescriptions = format_record_dates(list(db.Prescriptions.aggregate(past_prescriptions_pipeline(patient_object_id))))
 
     return render_template('view_patient.html', 
                          patient=patient_info, 
@@ -510,158 +418,78 @@ def advanced_search():
 
     db = get_db_connection()
 
-    pipeline = [
-        {
-            '$lookup': {
-                'from': 'Users',
-                'localField': 'UserID',
-                'foreignField': '_id',
-                'as': 'user'
-            }
-        },
-        {
-            '$unwind': '$user'
-        },
-        # Add PatientHistory lookup by default
-        {
-            '$lookup': {
-                'from': 'PatientHistory',
-                'let': { 'patient_id': '$_id' },
-                'pipeline': [
-                    {
-                        '$match': {
-                            '$expr': { '$eq': ['$patient_id', '$$patient_id'] }
-                        }
-                    },
-                    {
-                        '$sort': { 'date': -1 }
-                    },
-                    {
-                        '$limit': 1
-                    }
-                ],
-                'as': 'latest_history'
-            }
-        },
-        {
-            '$addFields': {
-                'latest_diagnosis': {
-                    '$cond': {
-                        'if': { '$gt': [{ '$size': '$latest_history' }, 0] },
-                        'then': { '$arrayElemAt': ['$latest_history.diagnosis', 0] },
-                        'else': 'No diagnosis'
-                    }
-                },
-                'diagnosis_date': {
-                    '$cond': {
-                        'if': { '$gt': [{ '$size': '$latest_history' }, 0] },
-                        'then': { '$arrayElemAt': ['$latest_history.date', 0] },
-                        'else': None
-                    }
-                }
-            }
-        }
-    ]
-
-    # Build match conditions
-    match_conditions = {
-        'user.IsStaff': 0
-    }
-
-    # Get form data for all fields
-    username = request.form.get('username', '')
-    email = request.form.get('email', '')
-    address = request.form.get('address', '')
-    contact_number = request.form.get('contact_number', '')
-    patient_name = request.form.get('patient_name', '')
-    nric = request.form.get('nric', '')
-    gender = request.form.get('gender', '')
-    dob = request.form.get('dob', '')
-    height = request.form.get('height', '')
-    weight = request.form.get('weight', '')
-    diagnosis = request.form.get('diagnosis', '')
-    diagnosis_date = request.form.get('diagnosis_date', '')
-
-    # Add filter conditions
-    if username:
-        match_conditions['user.Username'] = {'$regex': username, '$options': 'i'}
-    if email:
-        match_conditions['user.Email'] = {'$regex': email, '$options': 'i'}
-    if address: 
-        match_conditions['user.Address'] = {'$regex': address, '$options': 'i'}
-    if patient_name:
-        match_conditions['PatientName'] = {'$regex': patient_name, '$options': 'i'}
-    if contact_number:  
-        match_conditions['user.ContactNumber'] = {'$regex': contact_number, '$options': 'i'}
-    if nric:
-        match_conditions['NRIC'] = {'$regex': nric, '$options': 'i'}
-    if gender:
-        if gender in ['Male', 'Female']:
-            gender_map = {'Male': 'M', 'Female': 'F'}
-            match_conditions['PatientGender'] = gender_map[gender]
-    if height:
-        try:
-            match_conditions['PatientHeight'] = float(height)
-        except ValueError:
-            pass
-    if weight:
-        try:
-            match_conditions['PatientWeight'] = float(weight)
-        except ValueError:
-            pass
-    if dob:
-        try:
-            match_conditions['PatientDOB'] = datetime.strptime(dob, '%Y-%m-%d')
-        except ValueError:
-            pass
-    if diagnosis:
-        match_conditions['latest_diagnosis'] = {'$regex': diagnosis, '$options': 'i'}
-    if diagnosis_date:
-        try:
-            diag_date = datetime.strptime(diagnosis_date, '%Y-%m-%d')
-            match_conditions['diagnosis_date'] = diag_date
-        except ValueError:
-            pass
+    try:
+        cursor = decode_cursor(request.form.get('cursor'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    page_size = current_app.config['PAGE_SIZE']
 
-    # Add match conditions to pipeline
-    if match_conditions:
-        pipeline.append({'$match': match_conditions})
+    user_conditions, patient_conditions = advanced_search_filters(request.form)
+    collection, pipeline, key = build_search_pipeline(user_conditions, patient_conditions, cursor, page_size, ADVANCED_SEARCH_PROJECTION)
 
     try:
-        patients = list(db.Patients.aggregate(pipeline))
-        
-        # Format dates and convert ObjectIds to strings
-        for patient in patients:
-            # Convert ObjectId to string
-            patient['_id'] = str(patient['_id'])
-            patient['UserID'] = str(patient['UserID'])
-            
-            # Convert user ObjectId
-            if 'user' in patient:
-                patient['user']['_id'] = str(patient['user']['_id'])
-            
-            # Format dates
-            if 'PatientDOB' in patient and patient['PatientDOB']:
-                if isinstance(patient['PatientDOB'], datetime):
-                    patient['PatientDOB'] = patient['PatientDOB'].strftime('%Y-%m-%d')
-                    
-            if 'diagnosis_date' in patient and patient['diagnosis_date']:
-                if isinstance(patient['diagnosis_date'], datetime):
-                    patient['diagnosis_date'] = patient['diagnosis_date'].strftime('%Y-%m-%d')
-                else:
-                    patient['diagnosis_date'] = 'N/A'
-            else:
-                patient['diagnosis_date'] = 'N/A'
+        patients, next_cursor, prev_cursor = build_page(list(db[collection].aggregate(pipeline)), cursor, page_size, key)
+
+        patients = [format_search_patient(patient) for patient in patients]
+
+        response = {'patients': patients, 'next': next_cursor, 'prev': prev_cursor}
 
-            # Clean up the temporary latest_history field
-            if 'latest_history' in patient:
-                del patient['latest_history']
+        # In debug mode, report how the search was executed
+        if current_app.debug:
+            response['explain'] = explain_search(db, collection, pipeline)
 
-        return json_util.dumps(patients)
+        return jsonify(response)
     except Exception as e:
-        print("Error occurred:", str(e))
+        logging.error(f"Advanced search failed: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
+# Relevance-ranked search across patient names, diagnoses and medications, using the TEXT indexes
+# kinds is a comma separated subset of patients, diagnoses and medications (all of them by default)
+@staff_bp.route('/record_search')
+def record_search():
+    if 'is_staff' not in session or session['is_staff'] != 1:
+        return jsonify({'error': 'Unauthorized'}), 403
+
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({'results': [], 'next': None, 'prev': None})
+
+    kinds = [kind for kind in request.args.get('kinds', '').split(',') if kind in SOURCES] or list(SOURCES)
+
+    try:
+        cursor = decode_cursor(request.args.get('cursor'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    db = get_db_connection()
+    results, next_cursor, prev_cursor = search_records(db, query, kinds, cursor, current_app.config['PAGE_SIZE'])
+
+    # Show the patient's name next to each diagnosis, looked up in one query for the whole page
+    patient_ids = {doc['patient_id'] for doc in results if doc['kind'] == 'diagnoses' and doc.get('patient_id')}
+    names = {}
+    if patient_ids:
+        names = {p['_id']: p.get('PatientName') for p in db.Patients.find({'_id': {'$in': list(patient_ids)}}, {'PatientName': 1})}
+
+    rows = []
+    for doc in results:
+        row = {'kind': doc['kind'], '_id': str(doc['_id']), 'score': doc['score']}
+        if doc['kind'] == 'patients':
+            row['title'] = doc.get('PatientName')
+            row['detail'] = doc.get('NRIC')
+            row['url'] = url_for('staff.edit_patient', patient_id=str(doc['_id']))
+        elif doc['kind'] == 'diagnoses':
+            row['title'] = doc.get('diagnosis')
+            row['detail'] = f"{names.get(doc.get('patient_id'), 'Unknown patient')}, {format_date(doc.get('date'))}"
+            if doc.get('patient_id') and doc.get('appt_id'):
+                row['url'] = url_for('staff.view_patient', patient_id=str(doc['patient_id']), appt_id=str(doc['appt_id']))
+        else:
+            row['title'] = doc.get('name')
+            row['detail'] = f"{doc.get('quantity', 0)} in stock"
+            row['url'] = url_for('medication.medications', search=doc.get('name'))
+        rows.append(row)
+
+    return jsonify({'results': rows, 'next': next_cursor, 'prev': prev_cursor})
+
 # Staff only feature: edit appointments for patients
 @staff_bp.route('/edit_appointment/<string:appt_id>', methods=['GET', 'POST'])
 def edit_appointment(appt_id):
@@ -673,12 +501,19 @@ def edit_appointment(appt_id):
         status = request.form['status']
         reason = request.form['reason']
 
-        db.Appointments.update_one({"_id": ObjectId(appt_id)}, {"$set": {
-            "appt_date": datetime.strptime(date, '%Y-%m-%d'),
-            "appt_time": time,
-            "appt_status": status,
-            "appt_reason": reason
-        }})
+        try:
+            db.Appointments.update_one({"_id": ObjectId(appt_id)}, {"$set": {
+                "appt_date": datetime.strptime(date, '%Y-%m-%d'),
+                "appt_time": time,
+                "appt_status": status,
+                "appt_reason": reason
+            }})
+        except DuplicateKeyError:
+            # The unique slot index rejects moving an appointment onto a slot that is already booked
+            invalidate_availability()
+            flash('This appointment slot is already taken. Please choose another time.', 'danger')
+            return redirect(url_for('staff.edit_appointment', appt_id=appt_id))
+        invalidate_availability()
 
         flash('Appointment updated successfully!', 'success')
         return redirect(url_for('staff.manage_appointment'))
@@ -748,7 +583,10 @@ def staff_book_appointment():
             }
 
             # Use atomic booking operation
-            if db_manager.atomic_book_appointment(appointment_data):
+            # The cached availability is stale either way: the slot is now booked, or it was already taken
+            booked = db_manager.atomic_book_appointment(appointment_data)
+            invalidate_availability()
+            if booked:
                 flash('Appointment booked successfully!', 'success')
                 return redirect(url_for('staff.staff_dashboard'))
             else:
@@ -767,6 +605,7 @@ def staff_book_appointment():
 def delete_appointment(appt_id):
     db = get_db_connection()
     db.Appointments.delete_one({"_id": ObjectId(appt_id)})
+    invalidate_availability()
 
     flash('Appointment deleted successfully!', 'success')
     return redirect(url_for('staff.manage_appointment'))
@@ -778,12 +617,53 @@ def complete_appointment(appt_id):
 
     try:
         db.Appointments.update_one({"_id": ObjectId(appt_id)}, {"$set": {"appt_status": 'Completed'}})
+        invalidate_availability()
         flash('Appointment completed successfully!', 'success')
     except Exception as e:
         flash('Error completing the appointment: {}'.format(str(e)), 'danger')
 
     return redirect(url_for('staff.manage_appointment'))
 
+# Batch appointment routes, for end-of-day processing from the Upcoming Appointment page
+# They take JSON ({"appt_ids": [...]} or {"moves": [...]}) and return one result per appointment
+def batch_response(results):
+    invalidate_availability()
+    succeeded = sum(1 for result in results if result["ok"])
+    return jsonify({'results': results, 'succeeded': succeeded, 'failed': len(results) - succeeded})
+
+@staff_bp.route('/appointments/complete', methods=['POST'])
+def complete_appointments_batch():
+    if 'is_staff' not in session or session['is_staff'] != 1:
+        return jsonify({'error': 'Unauthorized'}), 403
+
+    appt_ids = (request.get_json(silent=True) or {}).get('appt_ids')
+    if not isinstance(appt_ids, list):
+        return jsonify({'error': 'appt_ids must be a list of appointment IDs.'}), 400
+
+    return batch_response(complete_appointments(get_db_connection(), appt_ids))
+
+@staff_bp.route('/appointments/delete', methods=['POST'])
+def delete_appointments_batch():
+    if 'is_staff' not in session or session['is_staff'] != 1:
+        return jsonify({'error': 'Unauthorized'}), 403
+
+    appt_ids = (request.get_json(silent=True) or {}).get('appt_ids')
+    if not isinstance(appt_ids, list):
+        return jsonify({'error': 'appt_ids must be a list of appointment IDs.'}), 400
+
+    return batch_response(delete_appointments(get_db_connection(), appt_ids))
+
+@staff_bp.route('/appointments/reschedule', methods=['POST'])
+def reschedule_appointments_batch():
+    if 'is_staff' not in session or session['is_staff'] != 1:
+        return jsonify({'error': 'Unauthorized'}), 403
+
+    moves = (request.get_json(silent=True) or {}).get('moves')
+    if not isinstance(moves, list) or not all(isinstance(move, dict) for move in moves):
+        return jsonify({'error': 'moves must be a list of {appt_id, date, time}.'}), 400
+
+    return batch_response(reschedule_appointments(get_db_connection(), moves))
+
 # Search medications route. Same feature as medications.
 @staff_bp.route('/search_medications')
 def search_medications():
@@ -792,15 +672,7 @@ def search_medications():
     if not query:
         return jsonify([])  # Return empty if no query is provided
 
-    db = get_db_connection()
-    medications_collection = db['Medications']
-
-    # Perform a case-insensitive search using regex and limit to 8 results
-    medications = list(medications_collection.find({
-        "name": {"$regex": query, "$options": "i"}
-    }).limit(20))  # Adjust limit as necessary
-
-    # Only return the name field for each medication
-    results = [{"name": medication['name']} for medication in medications]
+    # Look the prefix up in the typeahead cache / in-memory autocomplete index, this never queries the DB
+    results = lookup_medications(query, limit=20)
 
     return jsonify(results)
\ No newline at end of file
@@ -0,0 +1,56 @@
+# This file hands out human-friendly sequential IDs (e.g. MedID) from the [Counters] collection.
+# Each counter is one document {"_id": <name>, "value": <last ID handed out>}, advanced with an atomic $inc,
+# so concurrent adds in any thread or worker never get the same ID and no collection has to be scanned for its max.
+# With a block size above 1 a worker reserves IDs in ranges and hands them out from memory; IDs left in a
+# reserved range when the worker stops are skipped, so IDs stay unique and increasing but may have gaps.
+# A counter that does not exist yet is created from seed(db), the last ID already in use, so IDs handed
+# out before the counter was added are never repeated.
+
+from threading import Lock
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+from config import Config
+from db import get_db_connection
+from migrations import highest_med_id
+
+class Sequence:
+    def __init__(self, get_db, name, block_size=1, seed=None):
+        self._get_db = get_db
+        self.name = name
+        self.block_size = block_size
+        self._seed = seed
+        self._next = 1  # Next ID of the reserved range
+        self._end = 0  # Last ID of the reserved range, nothing is reserved yet
+        self._lock = Lock()
+
+    # Reserve count IDs in one round trip, returns the range of them
+    def reserve(self, count):
+        db = self._get_db()
+        counter = self._increment(db, count)
+        if counter is None:
+            # Two round trips more, only the first time. If another worker creates it first, its value is used.
+            try:
+                db.Counters.insert_one({"_id": self.name, "value": self._seed(db) if self._seed else 0})
+            except DuplicateKeyError:
+                pass
+            counter = self._increment(db, count)
+        return range(counter["value"] - count + 1, counter["value"] + 1)
+
+    # Advance the counter by count, None if it does not exist
+    def _increment(self, db, count):
+        return db.Counters.find_one_and_update(
+            {"_id": self.name},
+            {"$inc": {"value": count}},
+            return_document=ReturnDocument.AFTER
+        )
+
+    def next_id(self):
+        with self._lock:
+            if self._next > self._end:
+                ids = self.reserve(self.block_size)
+                self._next, self._end = ids.start, ids.stop - 1
+            new_id = self._next
+            self._next += 1
+            return new_id
+
+med_ids = Sequence(get_db_connection, "MedID", Config.MED_ID_BLOCK_SIZE, seed=highest_med_id)
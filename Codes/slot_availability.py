@@ -0,0 +1,54 @@
+# This file works out which appointment slots are free over the booking window (today and the next 7 days).
+# The booking pages use it to only offer free slots, instead of finding out about a clash when the booking is saved.
+# The map is built with one range query on the (appt_date, appt_time) index and cached in memory.
+# Routes that book, move, delete or complete appointments call invalidate_availability().
+
+from datetime import datetime, timedelta
+from config import Config
+from cache import TTLCache
+
+# The 30 minute slots offered by the booking forms, 08:00 to 16:30
+SLOT_TIMES = [f"{hour:02d}:{minute:02d}" for hour in range(8, 17) for minute in (0, 30)]
+BOOKING_WINDOW_DAYS = 7
+
+# Keyed on the first day of the window, so the map rolls over by itself at midnight
+# The TTL bounds how long another worker's bookings can go unseen
+availability_cache = TTLCache(maxsize=2, ttl=Config.SLOT_CACHE_TTL)
+
+def invalidate_availability():
+    availability_cache.bump()
+
+# Build the availability map of the booking window starting at start (a date)
+# Returns {"times": [...], "days": {"YYYY-MM-DD": [1 if booked else 0 for each slot time]}}
+def build_availability(db, start):
+    first = datetime.combine(start, datetime.min.time())
+    end = first + timedelta(days=BOOKING_WINDOW_DAYS + 1)
+
+    slot_index = {time: i for i, time in enumerate(SLOT_TIMES)}
+    days = {
+        (start + timedelta(days=offset)).strftime('%Y-%m-%d'): [0] * len(SLOT_TIMES)
+        for offset in range(BOOKING_WINDOW_DAYS + 1)
+    }
+
+    # Every appointment holds its slot whatever its status, the same as the unique slot index
+    booked = db.Appointments.find(
+        {"appt_date": {"$gte": first, "$lt": end}},
+        {"_id": 0, "appt_date": 1, "appt_time": 1}
+    )
+    for appointment in booked:
+        day = days.get(appointment["appt_date"].strftime('%Y-%m-%d'))
+        i = slot_index.get(appointment.get("appt_time"))
+        if day is not None and i is not None:
+            day[i] = 1
+
+    return {"times": SLOT_TIMES, "days": days}
+
+# Cached availability of the current booking window
+def get_availability(db):
+    start = datetime.now().date()
+    availability = availability_cache.get(start)
+    if availability is None:
+        generation = availability_cache.generation
+        availability = build_availability(db, start)
+        availability_cache.set(start, availability, generation)
+    return availability
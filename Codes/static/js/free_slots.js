@@ -0,0 +1,28 @@
+// Only offer the appointment slots that are still free on the chosen date.
+// Used by the booking pages: the #appt_date input holds the availability URL in data-availability-url.
+function showFreeSlots() {
+    const dateInput = document.getElementById('appt_date');
+    const date = dateInput.value;
+    const select = document.getElementById('appt_time');
+    if (!date) {
+        return;
+    }
+    fetch(dateInput.dataset.availabilityUrl)
+    .then(response => response.json())
+    .then(availability => {
+        const booked = availability.days[date] || [];
+        Array.from(select.options).forEach(option => {
+            const taken = booked[availability.times.indexOf(option.value)] === 1;
+            option.disabled = taken;
+            option.textContent = taken ? `${option.value} (booked)` : option.value;
+        });
+        if (select.selectedOptions.length && select.selectedOptions[0].disabled) {
+            const free = Array.from(select.options).find(option => !option.disabled);
+            select.value = free ? free.value : '';
+        }
+    })
+    .catch(error => {
+        console.error('Error:', error);
+    });
+}
+document.getElementById('appt_date').addEventListener('change', showFreeSlots);
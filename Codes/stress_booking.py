@@ -0,0 +1,60 @@
+# This file checks that an appointment slot can only be booked once, however many processes try at the same time.
+# Run it against a DB that has had migrate.py applied (a local mongod is best, MONGO_URI=mongodb://localhost:27017):
+#     python stress_booking.py -p 32
+# Every process books the same slot far in the future through DatabaseManager.atomic_book_appointment.
+# Exactly one booking must win. The test appointments are deleted afterwards.
+
+import argparse
+import multiprocessing
+import sys
+from datetime import datetime
+from bson.objectid import ObjectId
+
+# A date no real appointment is booked on
+TEST_DATE = datetime(2099, 1, 1)
+TEST_TIME = "08:00"
+
+def book(barrier, patient_id):
+    # Imported in the child, so every process connects with its own client
+    from db_config import DatabaseManager
+    db_manager = DatabaseManager()
+    barrier.wait()  # Start all the bookings together
+    return db_manager.atomic_book_appointment({
+        "patient_id": patient_id,
+        "appt_date": TEST_DATE,
+        "appt_time": TEST_TIME,
+        "appt_status": 'Pending',
+        "appt_reason": 'stress_booking.py'
+    })
+
+def main():
+    parser = argparse.ArgumentParser(description="Book the same appointment slot from many processes at once.")
+    parser.add_argument('-p', '--processes', type=int, default=16, help="processes booking the slot")
+    args = parser.parse_args()
+
+    from db_config import DatabaseManager
+    from migrations import UNIQUE_APPOINTMENT_SLOT_VERSION
+    db_manager = DatabaseManager()
+    # Without the unique slot index bookings from different processes are not checked against each other
+    if not db_manager.has_schema_version(UNIQUE_APPOINTMENT_SLOT_VERSION):
+        sys.exit("The unique appointment slot index is missing, run 'python migrate.py' first.")
+    db = db_manager.get_db()
+    test_slot = {"appt_date": TEST_DATE, "appt_time": TEST_TIME}
+    db.Appointments.delete_many(test_slot)
+
+    context = multiprocessing.get_context('spawn')
+    barrier = context.Manager().Barrier(args.processes)
+    with context.Pool(args.processes) as pool:
+        results = pool.starmap(book, [(barrier, ObjectId()) for _ in range(args.processes)])
+
+    stored = db.Appointments.count_documents(test_slot)
+    db.Appointments.delete_many(test_slot)
+
+    print(f"{args.processes} processes: {sum(results)} bookings succeeded, {stored} stored.")
+    if sum(results) != 1 or stored != 1:
+        print("FAIL: the slot must be booked exactly once.")
+        sys.exit(1)
+    print("OK")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+# This file load tests the shared DatabaseManager from many threads, like a threaded Flask worker does.
+# Run it against a local mongod (MONGO_URI=mongodb://localhost:27017), e.g.
+#     python stress_db_pool.py -t 200 -n 50
+#     MONGO_MAX_POOL_SIZE=10 MONGO_WAIT_QUEUE_TIMEOUT_MS=100 python stress_db_pool.py -t 200
+# All threads create the manager at the same moment, so the singleton is raced on first use; every
+# thread must get the same instance. Each thread then runs queries, so more threads than
+# MONGO_MAX_POOL_SIZE have to queue for a connection, and waits past MONGO_WAIT_QUEUE_TIMEOUT_MS fail.
+
+import argparse
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from threading import Barrier
+from pymongo.errors import PyMongoError, WaitQueueTimeoutError
+from config import Config
+from db_config import DatabaseManager
+
+def worker(barrier, queries):
+    barrier.wait()
+    manager = DatabaseManager()
+    latencies, timeouts, errors = [], 0, 0
+    for _ in range(queries):
+        started = time.perf_counter()
+        try:
+            manager.get_db().Medications.find_one({}, {"_id": 1})
+            latencies.append(time.perf_counter() - started)
+        except WaitQueueTimeoutError:
+            timeouts += 1
+        except PyMongoError:
+            errors += 1
+    return id(manager), latencies, timeouts, errors
+
+def main():
+    parser = argparse.ArgumentParser(description="Query the DB from many threads through the shared DatabaseManager.")
+    parser.add_argument('-t', '--threads', type=int, default=200, help="threads started together")
+    parser.add_argument('-n', '--queries', type=int, default=20, help="queries per thread")
+    args = parser.parse_args()
+
+    barrier = Barrier(args.threads)
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.threads) as executor:
+        results = list(executor.map(lambda _: worker(barrier, args.queries), range(args.threads)))
+    elapsed = time.perf_counter() - started
+
+    instances = {instance for instance, _, _, _ in results}
+    latencies = sorted(latency * 1000 for _, thread_latencies, _, _ in results for latency in thread_latencies)
+    timeouts = sum(timeouts for _, _, timeouts, _ in results)
+    errors = sum(errors for _, _, _, errors in results)
+    total = args.threads * args.queries
+
+    print(f"pool: maxPoolSize {Config.MONGO_MAX_POOL_SIZE}, waitQueueTimeoutMS {Config.MONGO_WAIT_QUEUE_TIMEOUT_MS}")
+    print(f"{total} queries from {args.threads} threads in {elapsed:.1f}s ({total / elapsed:.0f} queries/s), "
+          f"{timeouts} wait queue timeouts, {errors} other errors")
+    if latencies:
+        percentile = lambda p: latencies[min(len(latencies) - 1, int(len(latencies) * p))]
+        print(f"latency ms: mean {statistics.mean(latencies):.1f}, p50 {percentile(0.5):.1f}, "
+              f"p95 {percentile(0.95):.1f}, p99 {percentile(0.99):.1f}")
+
+    if len(instances) != 1:
+        print(f"FAIL: {len(instances)} DatabaseManager instances were created, expected 1.")
+        sys.exit(1)
+    print("OK: one DatabaseManager shared by all threads")
+
+if __name__ == '__main__':
+    main()
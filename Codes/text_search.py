@@ -0,0 +1,168 @@
+# This file runs the relevance-ranked record search over patients, diagnoses and medications.
+# It uses the TEXT indexes on [Patients].PatientName, [PatientHistory].diagnosis and [Medications].name.
+# If a collection has no text index (e.g. migrate.py has not been run), a local inverted index
+# built from that collection is used instead, so the search still works without a collection scan per query.
+
+import logging
+import math
+import re
+import time
+from collections import Counter, defaultdict
+from threading import Lock
+from pymongo.errors import OperationFailure
+from config import Config
+from pagination import build_page
+
+# Error code MongoDB returns for a $text query on a collection without a text index
+INDEX_NOT_FOUND = 27
+
+# kind -> (collection, text field, fields returned with each result)
+SOURCES = {
+    "patients": ("Patients", "PatientName", {"PatientName": 1, "NRIC": 1, "PatientDOB": 1}),
+    "diagnoses": ("PatientHistory", "diagnosis", {"diagnosis": 1, "date": 1, "patient_id": 1, "appt_id": 1}),
+    "medications": ("Medications", "name", {"name": 1, "quantity": 1}),
+}
+
+TOKEN = re.compile(r'\w+')
+
+def tokenise(text):
+    return TOKEN.findall(str(text or '').lower())
+
+# Results are ordered by (rank, kind, _id) where rank is the negated score, so the best match comes first
+def result_key(doc):
+    return [doc["rank"], doc["kind"], doc["_id"]]
+
+# $match that seeks past the cursor in one collection. Every result of a collection has the same kind,
+# so comparing the kind against the cursor's decides whether ties on rank come before or after it.
+def seek_match(kind, cursor):
+    if cursor is None:
+        return None
+    (rank, last_kind, last_id), direction = cursor
+    op = "$gt" if direction == "next" else "$lt"
+
+    if kind == last_kind:
+        return {"$or": [{"rank": {op: rank}}, {"rank": rank, "_id": {op: last_id}}]}
+    if (kind > last_kind) == (direction == "next"):
+        return {"rank": {op + "e": rank}}
+    return {"rank": {op: rank}}
+
+# Up to limit results of one collection past the cursor, ranked by the text index
+def text_index_results(db, kind, query, cursor, limit):
+    collection, field, projection = SOURCES[kind]
+    order = 1 if cursor is None or cursor[1] == "next" else -1
+
+    pipeline = [
+        {"$match": {"$text": {"$search": query}}},
+        {"$project": dict(projection, rank={"$multiply": [{"$meta": "textScore"}, -1]})},
+    ]
+    seek = seek_match(kind, cursor)
+    if seek:
+        pipeline.append({"$match": seek})
+    pipeline.append({"$sort": {"rank": order, "_id": order}})
+    pipeline.append({"$limit": limit})
+
+    results = list(db[collection].aggregate(pipeline))
+    for doc in results:
+        doc["kind"] = kind
+    return results
+
+class LocalTextIndex:
+    # In-memory inverted index of one text field, used when the collection has no text index
+    def __init__(self, get_db, kind, refresh_interval):
+        self._get_db = get_db
+        self.kind = kind
+        self.refresh_interval = refresh_interval
+        self._postings = {}  # token -> {_id: term frequency}
+        self._lengths = {}  # _id -> number of tokens in the field
+        self._lock = Lock()
+        self._loaded_at = None
+
+    def load(self):
+        collection, field, _ = SOURCES[self.kind]
+        postings = defaultdict(dict)
+        lengths = {}
+        for doc in self._get_db()[collection].find({}, {field: 1}):
+            tokens = tokenise(doc.get(field))
+            if not tokens:
+                continue
+            lengths[doc["_id"]] = len(tokens)
+            for token, count in Counter(tokens).items():
+                postings[token][doc["_id"]] = count
+
+        with self._lock:
+            self._postings = dict(postings)
+            self._lengths = lengths
+            self._loaded_at = time.monotonic()
+        logging.info(f"Built the local text index of {len(lengths)} {self.kind}")
+
+    # {_id: score} of every document containing at least one of the query terms
+    # Terms are weighted by how rare they are and scores favour short fields, similar to a $text score
+    def scores(self, query):
+        if self._loaded_at is None or time.monotonic() - self._loaded_at > self.refresh_interval:
+            self.load()
+
+        scores = defaultdict(float)
+        with self._lock:
+            total = len(self._lengths)
+            for token in set(tokenise(query)):
+                matches = self._postings.get(token, {})
+                if not matches:
+                    continue
+                idf = math.log(1 + total / len(matches))
+                for doc_id, count in matches.items():
+                    scores[doc_id] += idf * count / self._lengths[doc_id]
+        return scores
+
+_local_indexes = {}
+_local_indexes_lock = Lock()
+
+def local_index(db, kind):
+    with _local_indexes_lock:
+        if kind not in _local_indexes:
+            logging.warning(f"No text index on {SOURCES[kind][0]}, using a local text index")
+            _local_indexes[kind] = LocalTextIndex(lambda: db, kind, Config.TEXT_INDEX_REFRESH)
+        return _local_indexes[kind]
+
+# Same as text_index_results, using the local inverted index
+def local_index_results(db, kind, query, cursor, limit):
+    collection, _, projection = SOURCES[kind]
+    scores = local_index(db, kind).scores(query)
+
+    ranked = [{"rank": -score, "kind": kind, "_id": doc_id} for doc_id, score in scores.items()]
+    if cursor is not None:
+        values, direction = cursor
+        if direction == "next":
+            ranked = [doc for doc in ranked if result_key(doc) > values]
+        else:
+            ranked = [doc for doc in ranked if result_key(doc) < values]
+    ranked.sort(key=result_key, reverse=cursor is not None and cursor[1] == "prev")
+    ranked = ranked[:limit]
+
+    # Fetch the returned fields of only the documents on this page
+    docs = {doc["_id"]: doc for doc in db[collection].find({"_id": {"$in": [r["_id"] for r in ranked]}}, projection)}
+    results = []
+    for r in ranked:
+        if r["_id"] in docs:
+            results.append(dict(docs[r["_id"]], rank=r["rank"], kind=kind))
+    return results
+
+# One page of results across the given kinds, best match first
+# Returns (results, next cursor, prev cursor); each result has kind, _id, score and its projected fields
+def search_records(db, query, kinds, cursor, page_size):
+    limit = page_size + 1
+    results = []
+    for kind in kinds:
+        try:
+            results.extend(text_index_results(db, kind, query, cursor, limit))
+        except OperationFailure as e:
+            if e.code != INDEX_NOT_FOUND:
+                raise
+            results.extend(local_index_results(db, kind, query, cursor, limit))
+
+    # Each kind returned its best page_size + 1, so the merged first page_size + 1 are the overall best
+    results.sort(key=result_key, reverse=cursor is not None and cursor[1] == "prev")
+    results, next_cursor, prev_cursor = build_page(results[:limit], cursor, page_size, result_key)
+
+    for doc in results:
+        doc["score"] = round(-doc.pop("rank"), 4)
+    return results, next_cursor, prev_cursor
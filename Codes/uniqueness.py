@@ -0,0 +1,46 @@
+# This file checks that identifying fields (username, email, contact number, NRIC) are not used by another account.
+# Each field is looked up on its own index and only _id is returned. The lookups are not covered, the index
+# has no _id to check the record being edited against, but each stops at the first other record. They run
+# at the same time on a small shared thread pool, so a form save waits for one lookup instead of several.
+
+from concurrent.futures import ThreadPoolExecutor
+from config import Config
+
+# field -> (collection, form error key, message)
+UNIQUE_FIELDS = {
+    "Username": ("Users", "username", "Username is already in use."),
+    "Email": ("Users", "email", "Email is already in use."),
+    "ContactNumber": ("Users", "contact_number", "Contact number is already in use."),
+    "NRIC": ("Patients", "nric", "NRIC is already in use."),
+}
+
+# PyMongo is thread-safe, so the lookups can share the worker's client and connection pool
+_executor = ThreadPoolExecutor(max_workers=Config.VALIDATION_THREADS, thread_name_prefix="validation")
+
+# Run independent DB calls concurrently, returns their results in the order given
+# The calls must not themselves wait on this pool, or a busy pool could deadlock
+def run_concurrently(*calls):
+    futures = [_executor.submit(call) for call in calls]
+    return [future.result() for future in futures]
+
+# values is {field: value} of the fields to check, exclude is {collection: _id} of the records being edited
+# Returns {form error key: message} for every value already used by another record
+def find_conflicts(db, values, exclude=None):
+    exclude = exclude or {}
+    fields = [field for field, value in values.items() if value]
+
+    def lookup(field):
+        collection = UNIQUE_FIELDS[field][0]
+        query = {field: values[field]}
+        if collection in exclude:
+            query["_id"] = {"$ne": exclude[collection]}
+        return db[collection].find_one(query, {"_id": 1})
+
+    found = run_concurrently(*[lambda field=field: lookup(field) for field in fields])
+
+    errors = {}
+    for field, conflict in zip(fields, found):
+        if conflict:
+            _, key, message = UNIQUE_FIELDS[field]
+            errors[key] = message
+    return errors
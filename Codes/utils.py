@@ -2,17 +2,41 @@
 
 import re
 
+# Patterns are compiled once, the bulk patient onboarding runs them over whole columns
+SG_POSTAL_CODE = re.compile(r'\b\d{6}\b')
+SG_PHONE = re.compile(r'^[689]\d{7}$')
+NRIC_FORMAT = re.compile(r'^[STFGMstfgm]\d{7}[A-Za-z]$')
+
+# NRIC / FIN checksum: the 7 digits are weighted, an offset is added for the prefix and the
+# remainder mod 11 picks the check letter from the prefix's table
+NRIC_WEIGHTS = (2, 7, 6, 5, 4, 3, 2)
+NRIC_OFFSETS = {"S": 0, "T": 4, "F": 0, "G": 4, "M": 3}
+NRIC_CHECK_LETTERS = {
+    "S": "JZIHGFEDCBA", "T": "JZIHGFEDCBA",
+    "F": "XWUTRQPNMLK", "G": "XWUTRQPNMLK",
+    "M": "XWUTRQPNJLK",
+}
+
 # Validation functions
 def is_valid_sg_address(address):
     """Check if the address contains a 6-digit Singapore postal code."""
     # Check if there's a 6-digit number anywhere in the address
-    return re.search(r'\b\d{6}\b', address) is not None
+    return SG_POSTAL_CODE.search(address) is not None
 
 def is_valid_sg_phone(phone):
     """Check if the phone number is a valid Singapore number (starts with 6, 8, or 9 and is 8 digits long)."""
-    return re.match(r'^[689]\d{7}$', phone) is not None
+    return SG_PHONE.match(phone) is not None
 
 # Validate NRIC format
 def is_valid_nric(nric):
     """Check if the NRIC is valid: starts with (S,T,F,G,M), followed by 7 digits and one letter."""
-    return re.match(r'^[STFGMstfgm]\d{7}[A-Za-z]$', nric)
\ No newline at end of file
+    return NRIC_FORMAT.match(nric)
+
+# Validate NRIC format and check letter
+def is_valid_nric_checksum(nric):
+    """Check if the NRIC has a valid format and its last letter matches the checksum of its digits."""
+    if not NRIC_FORMAT.match(nric):
+        return False
+    prefix = nric[0].upper()
+    total = sum(int(digit) * weight for digit, weight in zip(nric[1:8], NRIC_WEIGHTS)) + NRIC_OFFSETS[prefix]
+    return NRIC_CHECK_LETTERS[prefix][total % 11] == nric[8].upper()